@@ -0,0 +1,128 @@
+"""Local stand-in for the Drive v3 resumable upload API.
+
+Point the bot at it with "drive_api_endpoint": "http://127.0.0.1:8765/" in
+config.json. Uploaded files are written to --dir, into directories for the
+folders created and for the parent IDs. --fail-rate makes chunk uploads fail
+with a 503 at random, to exercise retries and resuming:
+
+    python benchmarks/fake_drive.py --dir /tmp/drive --fail-rate 0.2
+"""
+import argparse
+import json
+import os
+import random
+import re
+import uuid
+from typing import Dict
+from aiohttp import web
+
+FOLDER_MIMETYPE = "application/vnd.google-apps.folder"
+CONTENT_RANGE = re.compile(r"bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)")
+
+
+class Session:
+    def __init__(self, name: str, parents):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.parents = parents
+        self.data = bytearray()
+
+
+class FakeDrive:
+    def __init__(self, dir: str, fail_rate: float):
+        self.dir = dir
+        self.fail_rate = fail_rate
+        self.sessions: Dict[str, Session] = {}
+        # Directories of the folders created, by ID
+        self.folders: Dict[str, str] = {}
+        self.uploaded = 0
+        self.failed = 0
+        os.makedirs(dir, exist_ok=True)
+
+    def resolve(self, parents) -> str:
+        """Directory for a file, parents that are not fake folders get a
+        directory of their own under --dir."""
+        parent = parents[0] if parents else "root"
+        return self.folders.get(parent) or os.path.join(self.dir, parent)
+
+    async def create_metadata(self, request: web.Request):
+        body = await request.json()
+        if body.get("mimeType") != FOLDER_MIMETYPE:
+            raise web.HTTPBadRequest(text="Only folders can be created without media")
+        file_id = uuid.uuid4().hex
+        self.folders[file_id] = path = os.path.join(self.resolve(body.get("parents")), body["name"])
+        os.makedirs(path, exist_ok=True)
+        return web.json_response(dict(id=file_id, name=body["name"], mimeType=FOLDER_MIMETYPE))
+
+    async def create(self, request: web.Request):
+        if request.query.get("uploadType") != "resumable":
+            raise web.HTTPBadRequest(text="Only resumable uploads are supported")
+        body = await request.json() if request.can_read_body else {}
+        session = Session(body.get("name", "untitled"), body.get("parents", []))
+        self.sessions[session.id] = session
+        location = request.url.update_query(upload_id=session.id)
+        return web.Response(headers={"Location": str(location)})
+
+    def incomplete(self, session: Session) -> web.Response:
+        headers = {"Range": f"bytes=0-{len(session.data) - 1}"} if session.data else {}
+        return web.Response(status=308, headers=headers)
+
+    async def put(self, request: web.Request):
+        session = self.sessions.get(request.query.get("upload_id", ""))
+        if session is None:
+            raise web.HTTPNotFound()
+        match = CONTENT_RANGE.fullmatch(request.headers.get("Content-Range", "bytes */*"))
+        if match is None:
+            raise web.HTTPBadRequest()
+        start, _, total = match.groups()
+        data = await request.read()
+        if start is not None:
+            if random.random() < self.fail_rate:
+                self.failed += 1
+                raise web.HTTPServiceUnavailable()
+            # A retried chunk may overlap what was already received
+            session.data[int(start):] = data
+        if total != "*" and len(session.data) == int(total):
+            return self.complete(session)
+        return self.incomplete(session)
+
+    def complete(self, session: Session) -> web.Response:
+        del self.sessions[session.id]
+        file_id = uuid.uuid4().hex
+        dir = self.resolve(session.parents)
+        os.makedirs(dir, exist_ok=True)
+        with open(os.path.join(dir, session.name), "wb") as fs:
+            fs.write(session.data)
+        self.uploaded += 1
+        return web.json_response(dict(id=file_id, name=session.name, parents=session.parents))
+
+    async def stats(self, request: web.Request):
+        return web.json_response(
+            dict(uploaded=self.uploaded, failed=self.failed, sessions=len(self.sessions))
+        )
+
+
+def create_app(dir: str, fail_rate: float = 0.0) -> web.Application:
+    drive = FakeDrive(dir, fail_rate)
+    app = web.Application(client_max_size=1024 ** 3)
+    # With the endpoint overridden, the client drops the drive/v3/ prefix
+    # from metadata requests but not from uploads
+    app.router.add_post("/files", drive.create_metadata)
+    app.router.add_post("/upload/drive/v3/files", drive.create)
+    app.router.add_put("/upload/drive/v3/files", drive.put)
+    app.router.add_get("/stats", drive.stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", required=True, help="Where uploaded files are written.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    print(json.dumps(vars(args)))
+    web.run_app(create_app(args.dir, args.fail_rate), host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
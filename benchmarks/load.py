@@ -0,0 +1,432 @@
+"""End-to-end load harness for the web app and the camera cog.
+
+Opens concurrent /stream.mjpg viewers and Socket.IO clients against the web
+app, and calls the CameraCog slash command handlers with fake interactions
+at fixed rates. Reports delivered fps, frame latency, handler latency and
+server CPU.
+
+Run from the bot's working directory, it reads config.json and timelapses
+are written to (and removed from) data/timelapses:
+
+    python benchmarks/load.py --viewers 20 --snap-rate 5 --output load.json
+    python benchmarks/load.py --url http://pi.local:5000 --server-pid 1234
+
+Without --url the aiohttp app is served in-process with a synthetic camera,
+so its CPU figure includes the clients. The cog handlers always run in this
+process, against --camera. The camera only streams while a Socket.IO client
+is connected, like with the index page open, so keep --socketio at 1 or
+more when measuring viewers.
+"""
+import sys
+import os
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(os.path.join(parent, "src"))
+
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import statistics
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+import aiohttp
+import socketio
+import config
+import constants
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return dict(n=0)
+    samples = sorted(samples)
+
+    def at(p):
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+    return dict(
+        n=len(samples),
+        mean=statistics.mean(samples),
+        p50=at(0.5),
+        p95=at(0.95),
+        p99=at(0.99),
+        max=samples[-1],
+    )
+
+
+class CpuSampler:
+    """CPU time of a process from /proc, as a percentage of one core."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK")
+
+    def cpu_time(self) -> Optional[float]:
+        try:
+            with open(f"/proc/{self.pid}/stat") as fs:
+                # The command name may contain spaces, fields start after it
+                fields = fs.read().rsplit(")", 1)[1].split()
+        except OSError:
+            return None
+        # utime and stime, fields 14 and 15
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+    def start(self):
+        self.t0 = time.monotonic()
+        self.cpu0 = self.cpu_time()
+
+    def stop(self) -> Optional[float]:
+        cpu = self.cpu_time()
+        if cpu is None or self.cpu0 is None:
+            return None
+        return 100 * (cpu - self.cpu0) / (time.monotonic() - self.t0)
+
+
+class Viewer:
+    """One /stream.mjpg client, timing frames by their X-Timestamp."""
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.latencies: List[float] = []
+        self.error: Optional[str] = None
+        self.started = 0.0
+        self.stopped = 0.0
+
+    async def run(self, session: aiohttp.ClientSession, url: str, duration: float):
+        self.started = time.monotonic()
+        try:
+            async with session.get(url) as response:
+                response.raise_for_status()
+                reader = aiohttp.MultipartReader.from_response(response)
+                end = self.started + duration
+                while time.monotonic() < end:
+                    part = await asyncio.wait_for(reader.next(), end - time.monotonic())
+                    if part is None:
+                        break
+                    data = await part.read()
+                    received = time.time()
+                    self.frames += 1
+                    self.bytes += len(data)
+                    if "X-Timestamp" in part.headers:
+                        self.latencies.append(received - float(part.headers["X-Timestamp"]))
+        except asyncio.TimeoutError:
+            pass
+        except (aiohttp.ClientError, ValueError) as e:
+            self.error = repr(e)
+        self.stopped = time.monotonic()
+
+    @property
+    def fps(self) -> float:
+        return self.frames / max(1e-9, self.stopped - self.started)
+
+
+async def run_socketio(url: str, duration: float, connect_times: List[float], errors: List[str]):
+    client = socketio.AsyncClient()
+    t = time.perf_counter()
+    try:
+        await client.connect(url)
+    except socketio.exceptions.ConnectionError as e:
+        errors.append(repr(e))
+        return
+    connect_times.append(time.perf_counter() - t)
+    await asyncio.sleep(duration)
+    await client.disconnect()
+
+
+async def paced(rate: float, duration: float, fn: Callable[[], Awaitable]):
+    """Starts fn `rate` times a second for `duration` seconds, without
+    waiting for earlier calls, and waits for all of them."""
+    if rate <= 0:
+        return
+    loop = asyncio.get_running_loop()
+    tasks = []
+    deadline = start = loop.time()
+    while deadline - start < duration:
+        tasks.append(loop.create_task(fn()))
+        deadline += 1 / rate
+        await asyncio.sleep(max(0.0, deadline - loop.time()))
+    await asyncio.gather(*tasks)
+
+
+class FakeBot:
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.errors: List[str] = []
+
+    async def wait_until_ready(self):
+        pass
+
+    async def log_error(self, e: Exception):
+        self.errors.append(repr(e))
+
+
+class FakeUser:
+    id = 0
+    mention = "@load"
+
+
+class FakeChannel:
+    def __init__(self):
+        self.messages: List[str] = []
+
+    async def send(self, content=None, **kwargs):
+        self.messages.append(content)
+
+
+class FakeResponse:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self) -> bool:
+        return self.done
+
+    async def send_message(self, content=None, **kwargs):
+        self.done = True
+        self.interaction.responded()
+
+    async def defer(self, **kwargs):
+        self.done = True
+        self.interaction.responded()
+
+
+class FakeFollowup:
+    async def send(self, content=None, **kwargs):
+        pass
+
+
+class FakeInteraction:
+    """Just enough of discord.Interaction for the CameraCog handlers.
+
+    Records when the first response and the final edit happened.
+    """
+
+    def __init__(self, channel: FakeChannel):
+        self.created = time.perf_counter()
+        self.first_response: Optional[float] = None
+        self.edited: Optional[float] = None
+        self.user = FakeUser()
+        self.channel = channel
+        self.guild_id = None
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup()
+
+    def responded(self):
+        if self.first_response is None:
+            self.first_response = time.perf_counter() - self.created
+
+    async def edit_original_response(self, **kwargs):
+        self.edited = time.perf_counter() - self.created
+
+
+class CogLoad:
+    """Drives CameraCog handlers directly, bypassing Discord."""
+
+    def __init__(self):
+        from cogs.camera import CameraCog
+
+        self.CameraCog = CameraCog
+        self.bot = FakeBot()
+        self.channel = FakeChannel()
+        self.cog = CameraCog(self.bot)
+        self.snap_latencies: List[float] = []
+        self.snap_errors: List[str] = []
+        self.progress_latencies: List[float] = []
+
+    async def snap(self, format: str, quality: int):
+        interaction = FakeInteraction(self.channel)
+        try:
+            await self.CameraCog.snap.callback(self.cog, interaction, True, format, quality)
+        except Exception as e:
+            self.snap_errors.append(repr(e))
+            return
+        self.snap_latencies.append(interaction.edited)
+
+    async def progress(self):
+        interaction = FakeInteraction(self.channel)
+        await self.CameraCog.timelapse_progress.callback(self.cog, interaction, None)
+        self.progress_latencies.append(interaction.first_response)
+
+    async def start_timelapses(self, count: int, interval: int) -> List[str]:
+        prefix = f"load-{int(time.time())}"
+        names = [f"{prefix}-{i}" for i in range(count)]
+        for name in names:
+            # Never finishes on its own, so nothing is encoded or uploaded
+            await self.CameraCog.timelapse_start.callback(
+                self.cog, FakeInteraction(self.channel), interval, 1_000_000, name
+            )
+        return names
+
+    async def stop_timelapses(self, names: List[str]) -> Dict[str, Dict]:
+        results = {}
+        for name in names:
+            schedule = self.cog.timelapses.get(name)
+            if schedule is None:
+                continue
+            results[name] = dict(
+                completed=schedule.completed,
+                mean_jitter=schedule.mean_jitter,
+                max_jitter=schedule.max_jitter,
+            )
+            schedule.cancel()
+        # The timelapse tasks clean up and unregister themselves
+        for _ in range(100):
+            if not any(name in self.cog.timelapses for name in names):
+                break
+            await asyncio.sleep(0.1)
+        return results
+
+
+async def serve(port: int):
+    from websocket import aio_app
+
+    return await aio_app.start("127.0.0.1", port)
+
+
+async def run(args) -> Dict:
+    runner = None
+    if args.url is None:
+        runner = await serve(args.port)
+        url = f"http://127.0.0.1:{args.port}"
+        server_pid = os.getpid()
+    else:
+        url = args.url.rstrip("/")
+        server_pid = args.server_pid
+
+    cog = CogLoad() if args.snap_rate > 0 or args.timelapses > 0 or args.progress_rate > 0 else None
+    timelapses = []
+    if cog and args.timelapses:
+        timelapses = await cog.start_timelapses(args.timelapses, args.timelapse_interval)
+
+    sio_connect_times: List[float] = []
+    sio_errors: List[str] = []
+    sio_tasks = [
+        asyncio.create_task(run_socketio(url, args.duration + 2, sio_connect_times, sio_errors))
+        for _ in range(args.socketio)
+    ]
+    # Let the camera start streaming before the viewers' clocks start
+    await asyncio.sleep(1.0)
+
+    cpu = CpuSampler(server_pid) if server_pid else None
+    if cpu:
+        cpu.start()
+    query = f"?scale={args.scale}&quality={args.quality}" if args.scale or args.quality else ""
+    viewers = [Viewer() for _ in range(args.viewers)]
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as session:
+        work = [viewer.run(session, f"{url}/stream.mjpg{query}", args.duration) for viewer in viewers]
+        if cog:
+            work.append(paced(args.snap_rate, args.duration, lambda: cog.snap(args.snap_format, args.snap_quality)))
+            work.append(paced(args.progress_rate, args.duration, cog.progress))
+        await asyncio.gather(*work)
+    server_cpu = cpu.stop() if cpu else None
+
+    timelapse_results = await cog.stop_timelapses(timelapses) if cog else {}
+    await asyncio.gather(*sio_tasks)
+    if runner is not None:
+        await runner.cleanup()
+
+    latencies = [latency for viewer in viewers for latency in viewer.latencies]
+    results = dict(
+        url=url,
+        duration=args.duration,
+        server_cpu_percent=server_cpu,
+        server_cpu_includes_clients=args.url is None,
+        viewers=dict(
+            count=len(viewers),
+            errors=[viewer.error for viewer in viewers if viewer.error],
+            fps=percentiles([viewer.fps for viewer in viewers]),
+            latency=percentiles(latencies),
+            megabytes=sum(viewer.bytes for viewer in viewers) / 1e6,
+        ),
+        socketio=dict(
+            count=args.socketio,
+            errors=sio_errors,
+            connect_time=percentiles(sio_connect_times),
+        ),
+    )
+    if cog:
+        results["cog"] = dict(
+            snap_rate=args.snap_rate,
+            snap_latency=percentiles(cog.snap_latencies),
+            snap_errors=cog.snap_errors,
+            snap_stats=cog.cog.snaps.stats,
+            progress_rate=args.progress_rate,
+            progress_latency=percentiles(cog.progress_latencies),
+            timelapses=timelapse_results,
+            errors=cog.bot.errors,
+        )
+    return results
+
+
+def print_summary(results: Dict):
+    viewers = results["viewers"]
+    if viewers["count"]:
+        fps, latency = viewers["fps"], viewers["latency"]
+        print(f"{viewers['count']} viewers: {fps.get('mean', 0):.1f} fps mean, {fps.get('p50', 0):.1f} median, {len(viewers['errors'])} errors")
+        if latency["n"]:
+            print(f"frame latency: p50 {latency['p50'] * 1000:.1f} ms, p95 {latency['p95'] * 1000:.1f} ms, p99 {latency['p99'] * 1000:.1f} ms")
+    sio = results["socketio"]
+    if sio["count"]:
+        print(f"{sio['count']} Socket.IO clients, {len(sio['errors'])} failed to connect")
+    if results["server_cpu_percent"] is not None:
+        shown = " (includes the clients)" if results["server_cpu_includes_clients"] else ""
+        print(f"server CPU: {results['server_cpu_percent']:.0f}%{shown}")
+    cog = results.get("cog")
+    if cog:
+        snap = cog["snap_latency"]
+        if snap["n"]:
+            print(f"snaps: {snap['n']} at {cog['snap_rate']}/s, p50 {snap['p50'] * 1000:.0f} ms, p95 {snap['p95'] * 1000:.0f} ms, {len(cog['snap_errors'])} errors, {cog['snap_stats']}")
+        progress = cog["progress_latency"]
+        if progress["n"]:
+            print(f"progress: {progress['n']} at {cog['progress_rate']}/s, p95 {progress['p95'] * 1000:.1f} ms")
+        for name, timelapse in cog["timelapses"].items():
+            print(f"timelapse {name}: {timelapse['completed']} captures, jitter {timelapse['mean_jitter'] * 1000:.0f} ms mean, {timelapse['max_jitter'] * 1000:.0f} ms max")
+        if cog["errors"]:
+            print(f"cog errors: {cog['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Web app to load, e.g. http://pi.local:5000. Defaults to serving it in-process.")
+    parser.add_argument("--port", type=int, default=constants.PORT + 1, help="Port for the in-process server.")
+    parser.add_argument("--server-pid", type=int, help="PID of the --url server, to report its CPU.")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--viewers", type=int, default=8, help="Concurrent /stream.mjpg clients.")
+    parser.add_argument("--socketio", type=int, default=1, help="Concurrent Socket.IO clients.")
+    parser.add_argument("--scale", default="", help="Stream scale for the viewers, e.g. 1/2.")
+    parser.add_argument("--quality", default="", help="Stream JPEG quality for the viewers.")
+    parser.add_argument("--snap-rate", type=float, default=0.0, help="/camera snap calls per second.")
+    parser.add_argument("--snap-format", default="jpeg")
+    parser.add_argument("--snap-quality", type=int, default=90)
+    parser.add_argument("--timelapses", type=int, default=0, help="Timelapses to run during the load.")
+    parser.add_argument("--timelapse-interval", type=int, default=1)
+    parser.add_argument("--progress-rate", type=float, default=0.0, help="/camera timelapse progress calls per second.")
+    parser.add_argument("--camera", default="synthetic", help="Camera backend for the in-process server and the cog.")
+    parser.add_argument("--camera-options", default="{}", help="JSON options for the synthetic or replay camera.")
+    parser.add_argument("--output", help="Write results to this JSON file.")
+    args = parser.parse_args()
+
+    config.CONFIG.camera_backend = args.camera
+    config.CONFIG.camera_options = json.loads(args.camera_options)
+    os.makedirs(constants.TIMELAPSES_DIR, exist_ok=True)
+
+    results = asyncio.run(run(args))
+    print_summary(results)
+    if args.output:
+        report = dict(
+            timestamp=str(datetime.datetime.now()),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            cpus=os.cpu_count(),
+            args=vars(args),
+            results=results,
+        )
+        with open(args.output, "wt", encoding="utf-8") as fs:
+            json.dump(report, fs, indent=4)
+
+
+if __name__ == "__main__":
+    main()
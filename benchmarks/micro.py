@@ -0,0 +1,304 @@
+"""Micro-benchmarks for the capture, encode, archive and stream hot paths.
+
+Runs offline against the synthetic, dummy or replay cameras, no Pi or
+Discord needed. Run from the repository root:
+
+    python benchmarks/micro.py --output before.json
+    python benchmarks/micro.py --output after.json --compare before.json
+"""
+import sys
+import os
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(os.path.join(parent, "src"))
+
+import argparse
+import asyncio
+import datetime
+import functools
+import io
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+import numpy as np
+import simplejpeg
+import archive
+import cameras
+import changes
+import encoders
+import video
+from websocket.streaming import StreamingOutput
+
+
+def parse_resolution(value: str) -> Tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def timed(fn: Callable, repeat: int, warmup: int = 1) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t)
+    samples.sort()
+    return dict(
+        n=len(samples),
+        mean=statistics.mean(samples),
+        median=statistics.median(samples),
+        p95=samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        min=samples[0],
+    )
+
+
+class Suite:
+    def __init__(self, repeat: int):
+        self.repeat = repeat
+        self.results: List[Dict] = []
+
+    def record(self, name: str, params: Dict, stats: Dict):
+        self.results.append(dict(name=name, params=params, stats=stats))
+        shown = ", ".join(f"{k}={v}" for k, v in params.items())
+        if "median" in stats:
+            print(f"{name} [{shown}]: median {stats['median'] * 1000:.2f} ms, p95 {stats['p95'] * 1000:.2f} ms")
+        else:
+            print(f"{name} [{shown}]: {stats}")
+
+    def bench_snap(self, camera: cameras.Camera, label: str):
+        params = dict(camera=label, width=camera.frame_shape[1], height=camera.frame_shape[0])
+        self.record("snap", params, timed(camera.snap, self.repeat))
+        self.record("snap_array", params, timed(camera.snap_array, self.repeat))
+        buffer = camera.empty_frame()
+        self.record("capture_into", params, timed(lambda: camera.capture_into(buffer), self.repeat))
+
+    def bench_encode(self, camera: cameras.Camera, label: str):
+        frame = camera.snap_frame()
+        rgb = frame.rgb
+        megapixels = rgb.shape[0] * rgb.shape[1] / 1e6
+        for format in ("jpeg", "webp", "png"):
+            stats = timed(
+                functools.partial(encoders.ENCODERS[format].encode, rgb, encoders.DEFAULT_QUALITY),
+                self.repeat,
+            )
+            stats["megapixels_per_s"] = megapixels / stats["median"]
+            self.record("encode", dict(camera=label, format=format, megapixels=megapixels), stats)
+
+        def png_optimize():
+            with io.BytesIO() as buffer:
+                frame.image.save(buffer, "PNG", optimize=True)
+
+        stats = timed(png_optimize, max(1, self.repeat // 4))
+        stats["megapixels_per_s"] = megapixels / stats["median"]
+        self.record("encode", dict(camera=label, format="png-optimize", megapixels=megapixels), stats)
+
+    def bench_changes(self, camera: cameras.Camera, label: str):
+        rgb = camera.snap_frame().rgb
+        detector = changes.ChangeDetector(1.0)
+        params = dict(camera=label, width=rgb.shape[1], height=rgb.shape[0])
+        self.record("change_check", params, timed(functools.partial(detector.check, rgb), self.repeat))
+
+    def write_timelapse(self, root: str, camera: cameras.Camera, frames: int) -> str:
+        # The quote makes sure paths given to ffmpeg are escaped
+        name = f"bench's-{frames}"
+        frames_dir = os.path.join(root, "data", "timelapses", name, "frames")
+        os.makedirs(frames_dir)
+        for i in range(frames):
+            camera.snap().save(os.path.join(frames_dir, f"{i}.png"), compress_level=1)
+        return name
+
+    def bench_archive(self, camera: cameras.Camera, label: str, frame_counts: List[int]):
+        with tempfile.TemporaryDirectory() as root:
+            for frames in frame_counts:
+                name = self.write_timelapse(root, camera, frames)
+                dir = os.path.join(root, "data", "timelapses", name)
+                path = os.path.join(root, f"{name}.zip")
+                stats = timed(functools.partial(archive.write_archive, dir, path, name), max(1, self.repeat // 4), warmup=0)
+                stats["megabytes"] = os.stat(path).st_size / 1e6
+                # Separate run, tracing slows it down
+                tracemalloc.start()
+                archive.write_archive(dir, path, name)
+                stats["peak_megabytes"] = tracemalloc.get_traced_memory()[1] / 1e6
+                tracemalloc.stop()
+                self.record("write_archive", dict(camera=label, frames=frames), stats)
+
+    def bench_ffmpeg(self, camera: cameras.Camera, label: str, frame_counts: List[int]):
+        if shutil.which("ffmpeg") is None:
+            print("ffmpeg not found, skipping video benchmarks")
+            return
+        with tempfile.TemporaryDirectory() as root:
+            for frames in frame_counts:
+                name = self.write_timelapse(root, camera, frames)
+                frames_dir = os.path.join(root, "data", "timelapses", name, "frames")
+                path = os.path.join(root, f"{name}.mp4")
+                stats = timed(functools.partial(video.encode_frames, frames_dir, path), 1, warmup=0)
+                stats["per_frame"] = stats["median"] / frames
+                self.record("encode_frames", dict(camera=label, frames=frames), stats)
+
+                def segmented(frames_dir=frames_dir, path=path):
+                    asyncio.run(video.SegmentedEncode(frames_dir, path).run())
+
+                stats = timed(segmented, 1, warmup=0)
+                stats["per_frame"] = stats["median"] / frames
+                self.record("encode_segments", dict(camera=label, frames=frames, jobs=os.cpu_count()), stats)
+
+                snaps = [camera.snap_frame().rgb for _ in range(min(frames, 8))]
+
+                def live(path=path, frames=frames, snaps=snaps):
+                    encoder = video.LiveEncoder(path)
+                    for i in range(frames):
+                        encoder.write(snaps[i % len(snaps)])
+                    encoder.close()
+
+                stats = timed(live, 1, warmup=0)
+                stats["per_frame"] = stats["median"] / frames
+                self.record("live_encode", dict(camera=label, frames=frames), stats)
+
+    def bench_fanout(self, width: int, height: int, readers: int, fps: float, duration: float):
+        """Writer publishes at `fps` like the camera, `readers` threads
+        consume. Times write() itself, which is what a slow viewer used to
+        stall."""
+        output = StreamingOutput()
+        frames = [
+            simplejpeg.encode_jpeg(np.random.randint(0, 255, (height, width, 3), dtype=np.uint8))
+            for _ in range(4)
+        ]
+        running = True
+        subscribed = [output.subscribe() for _ in range(readers)]
+
+        def read(reader):
+            while running:
+                reader.next_frame(timeout=0.1)
+
+        threads = [threading.Thread(target=read, args=(r,)) for r in subscribed]
+        for thread in threads:
+            thread.start()
+        writes = []
+        t = deadline = time.perf_counter()
+        while time.perf_counter() - t < duration:
+            w = time.perf_counter()
+            output.write(frames[len(writes) % len(frames)])
+            writes.append(time.perf_counter() - w)
+            deadline += 1 / fps
+            time.sleep(max(0.0, deadline - time.perf_counter()))
+        running = False
+        for thread in threads:
+            thread.join()
+        writes.sort()
+        delivered = [r.delivered / len(writes) for r in subscribed]
+        self.record(
+            "stream_fanout",
+            dict(width=width, height=height, readers=readers, fps=fps),
+            dict(
+                n=len(writes),
+                mean=statistics.mean(writes),
+                median=statistics.median(writes),
+                p95=writes[int(len(writes) * 0.95)],
+                min=writes[0],
+                delivered_ratio_mean=statistics.mean(delivered),
+                delivered_ratio_min=min(delivered),
+                dropped_mean=statistics.mean(r.dropped for r in subscribed),
+            ),
+        )
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=parent
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+def compare(results: List[Dict], baseline_path: str):
+    with open(baseline_path) as fs:
+        baseline = json.load(fs)
+    old = {
+        (r["name"], json.dumps(r["params"], sort_keys=True)): r["stats"]
+        for r in baseline["results"]
+    }
+    print(f"\nCompared to {baseline_path} ({baseline.get('commit')}):")
+    for r in results:
+        before = old.get((r["name"], json.dumps(r["params"], sort_keys=True)))
+        if before is None or "median" not in r["stats"] or "median" not in before:
+            continue
+        ratio = r["stats"]["median"] / before["median"]
+        shown = ", ".join(f"{k}={v}" for k, v in r["params"].items())
+        print(f"{r['name']} [{shown}]: {ratio:.2f}x median time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resolutions", default="640x480,2028x1520", help="Comma separated WxH sweep.")
+    parser.add_argument("--frames", default="10,100", help="Comma separated frame count sweep.")
+    parser.add_argument("--readers", default="1,8,32", help="Comma separated stream reader sweep.")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--stream-fps", type=float, default=30.0)
+    parser.add_argument("--fanout-duration", type=float, default=2.0)
+    parser.add_argument("--replay", help="Timelapse directory or MJPEG file to also benchmark with.")
+    parser.add_argument("--dummy", action="store_true", help="Also benchmark DummyCamera, needs data/sample_snap.npy.")
+    parser.add_argument("--skip", default="", help="Comma separated groups to skip: snap,encode,changes,archive,ffmpeg,fanout.")
+    parser.add_argument("--output", help="Write results to this JSON file.")
+    parser.add_argument("--compare", help="Results JSON of an earlier run to compare against.")
+    args = parser.parse_args()
+
+    resolutions = [parse_resolution(r) for r in args.resolutions.split(",")]
+    frame_counts = [int(x) for x in args.frames.split(",")]
+    skip = set(filter(None, args.skip.split(",")))
+    suite = Suite(args.repeat)
+
+    backends = [
+        (f"synthetic-{w}x{h}", lambda w=w, h=h: cameras.SyntheticCamera(w, h))
+        for w, h in resolutions
+    ]
+    if args.dummy:
+        backends.append(("dummy", cameras.DummyCamera))
+    if args.replay:
+        backends.append(("replay", lambda: cameras.ReplayCamera(os.path.abspath(args.replay))))
+
+    for label, factory in backends:
+        camera = factory()
+        if "snap" not in skip:
+            suite.bench_snap(camera, label)
+        if "encode" not in skip:
+            suite.bench_encode(camera, label)
+        if "changes" not in skip:
+            suite.bench_changes(camera, label)
+        if "archive" not in skip:
+            suite.bench_archive(camera, label, frame_counts)
+        if "ffmpeg" not in skip:
+            suite.bench_ffmpeg(camera, label, frame_counts)
+
+    if "fanout" not in skip:
+        for width, height in resolutions:
+            # The stream carries the lores size
+            for readers in (int(x) for x in args.readers.split(",")):
+                suite.bench_fanout(width // 5, height // 5, readers, args.stream_fps, args.fanout_duration)
+
+    report = dict(
+        commit=git_commit(),
+        timestamp=str(datetime.datetime.now()),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        cpus=os.cpu_count(),
+        results=suite.results,
+    )
+    if args.output:
+        with open(args.output, "wt", encoding="utf-8") as fs:
+            json.dump(report, fs, indent=4)
+    if args.compare:
+        compare(suite.results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
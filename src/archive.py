@@ -0,0 +1,127 @@
+import os
+import pathlib
+import queue
+import threading
+import zipfile
+from typing import BinaryIO, List, Optional, Tuple, Union
+import constants
+
+CHUNK_SIZE = 1024 * 1024
+# Chunks read ahead of the writer. Memory use is about this many chunks, no
+# matter how many or how large the files are.
+READAHEAD = 4
+# Already compressed, deflating them again costs CPU for no gain
+STORED_EXTENSIONS = frozenset({
+    ".png", ".jpg", ".jpeg", ".webp", ".gif",
+    ".mp4", ".mkv", ".webm", ".mjpg",
+    ".zip", ".gz", ".xz",
+})
+
+
+def compression_for(path: Union[str, pathlib.Path]) -> int:
+    """ZIP_STORED for compressed media, ZIP_DEFLATED for the rest, i.e.
+    JSON, logs and raw arrays."""
+    if pathlib.Path(path).suffix.lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def list_entries(dir: str, prefix: Optional[str] = None) -> List[Tuple[pathlib.Path, str]]:
+    """(path, name in the archive) of every file under dir, names are
+    relative to dir and start with `prefix/` if given."""
+    root = pathlib.Path(dir)
+    entries = []
+    for path in sorted(root.rglob("*")):
+        if path.is_file():
+            name = path.relative_to(root).as_posix()
+            entries.append((path, f"{prefix}/{name}" if prefix else name))
+    return entries
+
+
+class _Reader(threading.Thread):
+    """Reads the files ahead of the writer into a bounded queue of chunks.
+
+    An empty chunk ends a file. Opening and reading, slow on an SD card,
+    overlaps with checksumming, compressing and writing the previous chunks.
+    """
+
+    def __init__(self, paths: List[pathlib.Path], readahead: int):
+        super().__init__(daemon=True)
+        self.paths = paths
+        self.chunks: queue.Queue = queue.Queue(readahead)
+        self.stopped = threading.Event()
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def run(self):
+        try:
+            for path in self.paths:
+                with open(path, "rb") as fs:
+                    while not self.stopped.is_set():
+                        chunk = fs.read(CHUNK_SIZE)
+                        self.put(chunk)
+                        if not chunk:
+                            break
+        except Exception as e:
+            self.put(e)
+
+    def get(self) -> bytes:
+        chunk = self.chunks.get()
+        if isinstance(chunk, Exception):
+            raise chunk
+        return chunk
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def write_archive(dir: str, sink: Union[str, BinaryIO], prefix: Optional[str] = None, readahead: int = READAHEAD) -> int:
+    """Zips every file under dir into sink, a path or a writable binary file.
+
+    Files are streamed chunk by chunk, so memory stays bounded. The sink does
+    not need to be seekable, e.g. a socket or pipe. Returns the number of
+    files archived.
+    """
+    entries = list_entries(dir, prefix)
+    reader = _Reader([path for path, _ in entries], readahead)
+    reader.start()
+    try:
+        with zipfile.ZipFile(sink, "w") as archive:
+            for path, name in entries:
+                # Size and mtime come from the file, the size decides ZIP64
+                info = zipfile.ZipInfo.from_file(path, name)
+                info.compress_type = compression_for(path)
+                with archive.open(info, "w") as entry:
+                    while True:
+                        chunk = reader.get()
+                        if not chunk:
+                            break
+                        entry.write(chunk)
+    finally:
+        reader.stop()
+    return len(entries)
+
+
+def archive_timelapse(name: str, path: Optional[str] = None) -> str:
+    """Archives a timelapse like `shutil.make_archive(name, "zip",
+    TIMELAPSES_DIR, name)`, entries are under `name/`.
+
+    Written to a temporary file first, the archive at `path` is always
+    complete. Returns the path, `name.zip` by default.
+    """
+    path = path or f"{name}.zip"
+    tmp = f"{path}.part"
+    try:
+        write_archive(os.path.join(constants.TIMELAPSES_DIR, name), tmp, prefix=name)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
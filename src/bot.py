@@ -5,10 +5,12 @@ import discord
 import cameras
 from discord.ext import commands
 import constants
-import logging.handlers
+import logs
 import checks
 import config
 import helpers
+from startup import STARTUP
+from uploads import UploadQueue
 
 class CameraBot(commands.Bot):
     def __init__(self) -> None:
@@ -28,31 +30,26 @@ class CameraBot(commands.Bot):
         self._setup_logger()
         self.tree.error(self.on_app_command_error)
         self.load_cogs_success = True
+        self.web_runner = None
+        self.uploads = UploadQueue()
 
     def _setup_logger(self):
         self.logger = logging.getLogger("discord")
         self.logger.setLevel(logging.DEBUG)
         logging.getLogger("discord.http").setLevel(logging.INFO)
 
-        handler = logging.handlers.RotatingFileHandler(
-            filename=f"{constants.LOGS_DIR}/discord.log",
-            encoding="utf-8",
-            maxBytes=500 * 1000,  # 5 KB
-            backupCount=5,  # Rotate through 5 files
+        # Written on a background thread, see logs.setup
+        self.log_listener = logs.setup(
+            self.logger, f"{constants.LOGS_DIR}/discord.log", config.CONFIG.log_format
         )
-        dt_fmt = "%Y-%m-%d %H:%M:%S"
-        formatter = logging.Formatter(
-            "[{asctime}] [{levelname:<8}] {name}: {message}", dt_fmt, style="{"
-        )
-        handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
 
     async def on_ready(self):
+        STARTUP.mark("ready")
         initialize_dirs()
 
         self.logger.info(f"Logged in as {self.user.name} (ID: {self.user.id})")
-        self.logger.info(f"Camera Module: {cameras.camera_instance}")
         self.logger.info("------")
+        self.loop.create_task(self.log_startup())
         if not self.load_cogs_success:
             await self.get_channel(config.CONFIG.dev_channel_id).send(
                 "STARTUP: Failed to load all cogs."
@@ -70,12 +67,38 @@ class CameraBot(commands.Bot):
                 self.logger.error(traceback.format_exc())
                 self.load_cogs_success = False
 
+    async def log_startup(self):
+        await STARTUP.wait_all()
+        try:
+            self.logger.info(f"Camera Module: {await STARTUP.wait('camera')}")
+        except Exception:
+            self.logger.error(f"Camera Module failed to start:\n{traceback.format_exc()}")
+        self.logger.info(f"Startup: {STARTUP.report()}")
+
     async def setup_hook(self):
-        await self.load_cogs()
+        # Neither is needed to log in, so they run while the gateway connects
+        STARTUP.background("camera", cameras.get_camera)
+        STARTUP.background("google client", helpers.import_google_client)
+        # Resumes uploads left over from the last run
+        self.uploads.start()
+        if config.CONFIG.stream_server == "aiohttp":
+            import websocket.aio_app
+
+            with STARTUP.phase("web server"):
+                self.web_runner = await websocket.aio_app.start()
+        with STARTUP.phase("cogs"):
+            await self.load_cogs()
         guild = discord.Object(id=config.CONFIG.dev_guild_id)
         self.tree.copy_global_to(guild=guild)
         # await self.tree.sync(guild=guild)
 
+    async def close(self):
+        await self.uploads.stop()
+        if self.web_runner is not None:
+            await self.web_runner.cleanup()
+        await super().close()
+        self.log_listener.stop()
+
     async def on_app_command_error(
         self,
         interaction: discord.Interaction,
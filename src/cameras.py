@@ -1,18 +1,124 @@
+import bisect
 import io
+import mmap
+import os
 import sys
-from threading import Thread
+from functools import cached_property
+from threading import Condition, Lock, Thread
 import time
-from typing import Any, Final
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
 import numpy as np
 from abc import ABC, abstractmethod
 import simplejpeg
 from PIL import Image
 
-if sys.platform.startswith("linux"):
-    import picamera2
-    from picamera2.picamera2 import Picamera2
-    from picamera2.encoders.mjpeg_encoder import MJPEGEncoder
-    from picamera2.outputs import FileOutput
+# Sensor resolution of the HQ camera, the largest the lab uses
+HQ_SENSOR = (4056, 3040)
+# Metadata that has to stop moving before AE/AWB count as settled
+CONVERGENCE_KEYS = ("ExposureTime", "AnalogueGain", "ColourGains")
+# Frame files ReplayCamera keeps in memory ahead of the replay position
+REPLAY_READAHEAD = 32
+
+
+def _values_close(a, b, tolerance: float) -> bool:
+    if a is None or b is None:
+        return a is b
+    if isinstance(a, (tuple, list)):
+        return len(a) == len(b) and all(_values_close(a[i], b[i], tolerance) for i in range(len(a)))
+    return abs(a - b) <= tolerance * max(abs(a), abs(b), 1e-9)
+
+
+def wait_for_convergence(
+    read_metadata: Callable[[], Dict],
+    keys: Iterable[str] = CONVERGENCE_KEYS,
+    target: Optional[Dict] = None,
+    stable_frames: int = 3,
+    tolerance: float = 0.02,
+    timeout: float = 3.0,
+) -> bool:
+    """Reads per-frame metadata until the camera's control loops settle.
+
+    Without a target, settled means AeLocked (when reported) and `keys`
+    staying within `tolerance` of each other for `stable_frames` frames.
+    With a target, settled means every target value is reached, e.g. after
+    set_controls. Returns False if `timeout` seconds pass first.
+    """
+    keys = tuple(keys)
+    deadline = time.monotonic() + timeout
+    previous = None
+    stable = 0
+    while time.monotonic() < deadline:
+        metadata = read_metadata()
+        if target is not None:
+            if all(_values_close(metadata.get(k), v, tolerance) for k, v in target.items()):
+                return True
+            continue
+        values = [metadata.get(k) for k in keys]
+        if previous is not None and _values_close(values, previous, tolerance):
+            stable += 1
+        else:
+            stable = 0
+        previous = values
+        if stable >= stable_frames and metadata.get("AeLocked", True):
+            return True
+    return False
+
+
+class SimulatedMetadata:
+    """Per-frame metadata of control loops converging on a target, so the
+    dummy backend exercises the same settling code as the Pi."""
+
+    def __init__(self, rate: float = 0.5, noise: float = 0.001, seed: Optional[int] = None, **target):
+        self.rate = rate
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.target = dict(target)
+        self.values = {k: v * 0.5 for k, v in self.target.items()}
+
+    def retarget(self, **target):
+        self.target.update(target)
+        for k, v in target.items():
+            self.values.setdefault(k, v * 0.5)
+
+    def __call__(self) -> Dict:
+        locked = True
+        for k, t in self.target.items():
+            v = self.values[k]
+            v += (t - v) * self.rate
+            self.values[k] = v
+            locked = locked and abs(t - v) <= 0.01 * abs(t)
+        metadata = {
+            k: v * (1 + self.rng.normal(0, self.noise)) for k, v in self.values.items()
+        }
+        metadata["AeLocked"] = locked
+        return metadata
+
+
+class Frame:
+    """A capture in the camera's native layout and dtype.
+
+    The PIL image is only built if something asks for it.
+    """
+
+    def __init__(self, array: np.ndarray, camera: "Camera"):
+        self.array = array
+        self.camera = camera
+
+    @cached_property
+    def image(self) -> Image.Image:
+        return self.camera.to_image(self.array)
+
+    @cached_property
+    def rgb(self) -> np.ndarray:
+        """HxWx3 uint8 view, no copy when that is already the native layout."""
+        if self.array.dtype == np.uint8 and self.array.ndim == 3 and self.array.shape[2] == 3:
+            return self.array
+        return np.asarray(self.image.convert("RGB"))
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.array.shape[1], self.array.shape[0]
+
 
 class Camera(ABC):
     dtype: str
@@ -23,9 +129,40 @@ class Camera(ABC):
     def set_params(self, params):
         pass
 
+    @property
     @abstractmethod
+    def frame_shape(self) -> Tuple[int, ...]:
+        """Shape of the arrays capture_into fills."""
+
+    @abstractmethod
+    def capture_into(self, buffer: np.ndarray):
+        """Captures straight into a preallocated frame_shape/dtype buffer."""
+
+    def empty_frame(self) -> np.ndarray:
+        return np.empty(self.frame_shape, self.dtype)
+
+    def snap_array(self) -> np.ndarray:
+        buffer = self.empty_frame()
+        self.capture_into(buffer)
+        return buffer
+
+    def snap_frame(self) -> Frame:
+        return Frame(self.snap_array(), self)
+
+    def to_image(self, array: np.ndarray) -> Image.Image:
+        return Image.fromarray(array)
+
     def snap(self) -> Image.Image:
-        pass
+        return self.to_image(self.snap_array())
+
+    def capture_metadata(self) -> Dict:
+        """Metadata of the next frame."""
+        return {}
+
+    def settle(self, target: Optional[Dict] = None, timeout: float = 3.0) -> bool:
+        """Blocks until the camera's control loops settle, see
+        wait_for_convergence."""
+        return wait_for_convergence(self.capture_metadata, target=target, timeout=timeout)
 
     @abstractmethod
     def start_stream(self, output):
@@ -42,6 +179,9 @@ class Camera(ABC):
 
 class RPiCamera(Camera):
     def __init__(self):
+        # Imported here, picamera2 is slow to import and only exists on a Pi
+        from picamera2.picamera2 import Picamera2
+
         self.picam2 = Picamera2()
         # https://www.raspberrypi.com/documentation/accessories/camera.html
         # 4.2.1.6. More on the encode stream
@@ -49,21 +189,18 @@ class RPiCamera(Camera):
         # Video stream from lores stream
         res = self.picam2.sensor_resolution
         self.shape = (int(res[0]/2), int(res[1]/2))
-        video_config = self.picam2.create_video_configuration(
-            main={"size": self.shape},
-            lores={"size": (int(self.shape[0]/5), int(self.shape[1]/5))},
-            encode="lores",
-            # 10 FPS
-            controls={"FrameDurationLimits": (100000, 100000)},
-        )
-        self.picam2.configure(video_config)
+        self.name = str(self)
+        # Configurations by main stream size, built once and reused by
+        # set_params
+        self.configurations = {}
+        self.picam2.configure(self.configuration(self.shape))
         self.picam2.start()
 
-        # Give time for Aec and Awb to settle, before disabling them
-        time.sleep(1)
+        # Let Aec and Awb settle, before disabling them
+        self.settle()
         self.picam2.set_controls({"AeEnable": False, "AwbEnable": False, "FrameRate": 1.0})
         # And wait for those settings to take effect
-        time.sleep(1)
+        self.settle(target={"FrameDuration": 1000000})
 
 
         self.dtype = "uint8"
@@ -73,21 +210,53 @@ class RPiCamera(Camera):
     def __str__(self) -> str:
         return "Raspberry Pi Camera"
 
+    def configuration(self, size):
+        """Video configuration with a `size` main stream for snaps and a lores
+        stream for the MJPEG encoder."""
+        if size not in self.configurations:
+            self.configurations[size] = self.picam2.create_video_configuration(
+                main={"size": size},
+                lores={"size": (int(size[0]/5), int(size[1]/5))},
+                encode="lores",
+                # 10 FPS
+                controls={"FrameDurationLimits": (100000, 100000)},
+            )
+        return self.configurations[size]
+
+    def capture_metadata(self):
+        return self.picam2.capture_metadata()
+
     def start_stream(self, output):
+        from picamera2.encoders.mjpeg_encoder import MJPEGEncoder
+        from picamera2.outputs import FileOutput
+
         self.picam2.start_encoder(MJPEGEncoder(), FileOutput(output))
 
     def stop_stream(self):
         self.picam2.stop_encoder()
 
-    def snap(self):
-        request: picamera2.picamera2.CompletedRequest = self.picam2.capture_request()
-        # snap: np.ndarray = request.make_array("main")
-        snap: Image.Image = request.make_image("main")
-        request.release()
-        return snap
+    @property
+    def frame_shape(self):
+        return (self.shape[1], self.shape[0], 3)
+
+    def capture_into(self, buffer):
+        from picamera2 import MappedArray
+
+        request = self.picam2.capture_request()
+        try:
+            # Maps the request's buffer in place, the copy into `buffer` is
+            # the only one. XBGR8888 pixels are laid out as [R, G, B, X].
+            with MappedArray(request, "main") as m:
+                np.copyto(buffer, m.array[..., :3])
+        finally:
+            request.release()
 
     def set_params(self, params):
+        """Applies exposure and gain as live controls. Only a size change
+        reconfigures the sensor, through a cached configuration."""
         msg = []
+        size = self.shape
+        controls = {}
         if "name" in params:
             newname = str(params["name"])
             msg.append("name: %s > %s" % (self.name, newname))
@@ -95,25 +264,29 @@ class RPiCamera(Camera):
         if "width" in params:
             newwidth = int(params["width"])
             msg.append("width: %d > %d" % (self.shape[0], newwidth))
-            self.shape[0] = newwidth
+            size = (newwidth, size[1])
         if "height" in params:
             newheight = int(params["height"])
             msg.append("height: %d > %d" % (self.shape[1], newheight))
-            self.shape[1] = newheight
+            size = (size[0], newheight)
         if "exposure" in params:
             newexposure = int(params["exposure"])
             msg.append("exposure: %d > %d" % (self.exposure, newexposure))
             self.exposure = newexposure
+            controls["ExposureTime"] = newexposure
         if "gain" in params:
             newgain = float(params["gain"])
-            msg.append("gain: %d > %d" % (self.gain, newgain))
+            msg.append("gain: %f > %f" % (self.gain, newgain))
             self.gain = newgain
-        self.picam2.stop()
-        capture_config = self.picam2.still_configuration(
-            main={"size": (self.shape[1], self.shape[0]), "format": "BGR888"}
-        )
-        self.picam2.configure(capture_config)
-        self.picam2.start({"ExposureTime": self.exposure, "AnalogueGain": self.gain})
+            controls["AnalogueGain"] = newgain
+        if size != self.shape:
+            self.shape = size
+            # Keeps the encoder attached, unlike a full stop/configure/start
+            self.picam2.switch_mode(self.configuration(size))
+            controls.update(ExposureTime=self.exposure, AnalogueGain=self.gain)
+        if controls:
+            self.picam2.set_controls(controls)
+            self.settle(target=controls)
         return "\n".join(msg)
 
 
@@ -127,15 +300,25 @@ class DummyCamera(Camera):
             np.frombuffer(p, dtype="uint8").reshape(self.shape).astype("double") / 255.0
         )
         self.exposure = 50.0
+        self.simulated_metadata = SimulatedMetadata(
+            ExposureTime=self.exposure, AnalogueGain=1.0
+        )
 
     def __str__(self) -> str:
         return "Dummy Camera"
 
-    def snap(self):
-        snap = np.random.poisson(
-            (self.parappa * 10.0 + 1.0) * self.exposure
-        ).astype("uint16")
-        return Image.fromarray(np.uint8(snap))
+    def capture_metadata(self):
+        return self.simulated_metadata()
+
+    @property
+    def frame_shape(self):
+        return self.shape
+
+    def capture_into(self, buffer):
+        buffer[...] = np.random.poisson((self.parappa * 10.0 + 1.0) * self.exposure)
+
+    def to_image(self, array):
+        return Image.fromarray(np.uint8(array))
 
     def start_stream(self, output: io.BufferedIOBase):
         self.is_streaming = True
@@ -163,16 +346,344 @@ class DummyCamera(Camera):
             newexposure = float(params["exposure"])
             msg.append("exposure: %f > %f" % (self.exposure, newexposure))
             self.exposure = newexposure
+            self.simulated_metadata.retarget(ExposureTime=newexposure)
+            self.settle(target={"ExposureTime": newexposure})
+        if "name" in params:
+            newname = str(params["name"])
+            msg.append("name: %s > %s" % (self.name, newname))
+            self.name = newname
+        return "\n".join(msg)
+
+
+class SyntheticCamera(Camera):
+    """Camera made of pre-generated noise, for benchmarking at realistic
+    resolutions on any machine.
+
+    Frames are drawn from a bank generated once up front, so a capture costs
+    a copy and a stream frame costs an encode.
+    """
+
+    def __init__(
+        self,
+        width: int = 2028,
+        height: int = 1520,
+        dtype: str = "uint8",
+        fps: float = 10.0,
+        bank_size: int = 4,
+        seed: Optional[int] = 0,
+        stream_quality: int = 85,
+    ):
+        if width > HQ_SENSOR[0] or height > HQ_SENSOR[1]:
+            raise ValueError(f"{width}x{height} is larger than the HQ sensor")
+        self.shape = (width, height)
+        self.dtype = dtype
+        self.fps = fps
+        self.bank_size = bank_size
+        self.stream_quality = stream_quality
+        self.name = str(self)
+        self.rng = np.random.default_rng(seed)
+        self.exposure = 10000
+        self.is_streaming = False
+        self._generate()
+
+    def __str__(self) -> str:
+        return "Synthetic Camera"
+
+    def _generate(self):
+        width, height = self.shape
+        # uint16 models a 12 bit sensor
+        high = 256 if np.dtype(self.dtype) == np.uint8 else 4096
+        self.bank = [
+            self.rng.integers(0, high, size=self.frame_shape, dtype=self.dtype)
+            for _ in range(self.bank_size)
+        ]
+        # Same main/lores ratio as RPiCamera
+        self.stream_bank = [
+            self.rng.integers(0, 256, size=(height // 5, width // 5, 3), dtype=np.uint8)
+            for _ in range(self.bank_size)
+        ]
+
+    @property
+    def frame_shape(self):
+        return (self.shape[1], self.shape[0], 3)
+
+    def capture_into(self, buffer):
+        np.copyto(buffer, self.bank[self.rng.integers(self.bank_size)])
+
+    def to_image(self, array):
+        if array.dtype != np.uint8:
+            array = (array >> 4).astype(np.uint8)
+        return Image.fromarray(array)
+
+    def capture_metadata(self):
+        return dict(ExposureTime=self.exposure, AnalogueGain=1.0, AeLocked=True)
+
+    def start_stream(self, output):
+        self.is_streaming = True
+
+        def stream():
+            # Absolute deadlines, so encode time does not lower the rate
+            deadline = time.monotonic()
+            while self.is_streaming:
+                output.write(
+                    simplejpeg.encode_jpeg(
+                        self.stream_bank[self.rng.integers(self.bank_size)],
+                        quality=self.stream_quality,
+                    )
+                )
+                deadline += 1 / self.fps
+                time.sleep(max(0.0, deadline - time.monotonic()))
+
+        self.worker = Thread(target=stream, daemon=True)
+        self.worker.start()
+
+    def stop_stream(self):
+        self.is_streaming = False
+        self.worker.join()
+
+    def set_params(self, params):
+        msg = []
+        shape = self.shape
+        if "name" in params:
+            newname = str(params["name"])
+            msg.append("name: %s > %s" % (self.name, newname))
+            self.name = newname
+        if "width" in params:
+            newwidth = int(params["width"])
+            msg.append("width: %d > %d" % (self.shape[0], newwidth))
+            shape = (newwidth, shape[1])
+        if "height" in params:
+            newheight = int(params["height"])
+            msg.append("height: %d > %d" % (self.shape[1], newheight))
+            shape = (shape[0], newheight)
+        if "exposure" in params:
+            newexposure = int(params["exposure"])
+            msg.append("exposure: %d > %d" % (self.exposure, newexposure))
+            self.exposure = newexposure
+        if shape != self.shape:
+            self.shape = shape
+            self._generate()
+        return "\n".join(msg)
+
+
+class ReplayCamera(Camera):
+    """Plays back a recorded timelapse or an MJPEG dump, for benchmarks that
+    need real image content.
+
+    `source` is a timelapse directory, its frames directory or an MJPEG
+    file. With `realtime`, frames follow the recorded timestamps scaled by
+    `speed`, otherwise every capture returns the next frame. Frame data is
+    memory-mapped (MJPEG) or read ahead in the background into a window of
+    REPLAY_READAHEAD frames (frames directories), so replay is not bound by
+    disk reads and memory does not grow with the length of the timelapse.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        realtime: bool = False,
+        speed: float = 1.0,
+        fps: float = 10.0,
+        stream_quality: int = 85,
+    ):
+        self.source = source
+        self.realtime = realtime
+        self.speed = speed
+        self.fps = fps
+        self.stream_quality = stream_quality
+        self.dtype = "uint8"
+        self.name = str(self)
+        self.exposure = 0
+        self.index = 0
+        self.is_streaming = False
+        self.frames = None
+        self._stream_cache: Dict[int, bytes] = {}
+        if os.path.isdir(source):
+            self._load_frames_dir(source)
+        else:
+            self._load_mjpeg(source)
+        first = self._decode(0)
+        self.shape = (first.shape[1], first.shape[0])
+        self.started = time.monotonic()
+
+    def __str__(self) -> str:
+        return "Replay Camera"
+
+    def _load_frames_dir(self, source: str):
+        import journal
+
+        dir = source
+        if os.path.isdir(os.path.join(source, "frames")):
+            dir = os.path.join(source, "frames")
+        paths = sorted(
+            (p for p in os.listdir(dir) if p.lower().endswith((".png", ".jpg", ".jpeg"))),
+            key=lambda p: int(os.path.splitext(p)[0]),
+        )
+        if not paths:
+            raise ValueError(f"No frames in {dir}")
+        self.paths = [os.path.join(dir, p) for p in paths]
+        self.timestamps = [i / self.fps for i in range(len(paths))]
+        timelapse_dir = os.path.dirname(os.path.normpath(dir))
+        if os.path.exists(os.path.join(timelapse_dir, journal.METADATA_FILE)):
+            timestamps = journal.load_metadata(timelapse_dir).get("timestamps", [])
+            if len(timestamps) >= len(paths):
+                self.timestamps = timestamps[:len(paths)]
+        self.count = len(paths)
+        # Frame files by index, within REPLAY_READAHEAD after the position
+        self.window: Dict[int, bytes] = {}
+        self.position = 0
+        self.moved = Condition()
+        self.prefetcher = Thread(target=self._prefetch, daemon=True)
+        self.prefetcher.start()
+
+    def _read(self, i: int) -> bytes:
+        with open(self.paths[i], "rb") as fs:
+            return fs.read()
+
+    def _ahead(self, i: int) -> bool:
+        return (i - self.position) % self.count < REPLAY_READAHEAD
+
+    def _store(self, i: int, data: bytes):
+        with self.moved:
+            if self._ahead(i):
+                self.window[i] = data
+            for j in [j for j in self.window if not self._ahead(j)]:
+                del self.window[j]
+
+    def _prefetch(self):
+        position = None
+        while True:
+            with self.moved:
+                while self.position == position:
+                    self.moved.wait()
+                position = self.position
+            for k in range(min(REPLAY_READAHEAD, self.count)):
+                i = (position + k) % self.count
+                if i not in self.window:
+                    self._store(i, self._read(i))
+                if self.position != position:
+                    break
+
+    def _load_mjpeg(self, source: str):
+        with open(source, "rb") as fs:
+            self.mmap = mmap.mmap(fs.fileno(), 0, access=mmap.ACCESS_READ)
+        starts = []
+        i = self.mmap.find(b"\xff\xd8\xff")
+        while i != -1:
+            starts.append(i)
+            i = self.mmap.find(b"\xff\xd8\xff", i + 3)
+        if not starts:
+            raise ValueError(f"No JPEG frames in {source}")
+        view = memoryview(self.mmap)
+        bounds = starts + [len(self.mmap)]
+        # Views into the mapping, nothing is read until a frame is used
+        self.frames = [view[bounds[i]:bounds[i + 1]] for i in range(len(starts))]
+        self.count = len(self.frames)
+        self.timestamps = [i / self.fps for i in range(self.count)]
+
+    def _frame_bytes(self, i: int):
+        if self.frames is not None:
+            return self.frames[i]
+        with self.moved:
+            self.position = i
+            self.moved.notify()
+            data = self.window.get(i)
+        if data is None:
+            # Read ahead has not got there yet
+            data = self._read(i)
+            self._store(i, data)
+        return data
+
+    def _decode(self, i: int) -> np.ndarray:
+        data = self._frame_bytes(i)
+        if simplejpeg.is_jpeg(data):
+            return simplejpeg.decode_jpeg(data, colorspace="RGB")
+        return np.asarray(Image.open(io.BytesIO(data)).convert("RGB"))
+
+    def _next_index(self) -> int:
+        if not self.realtime:
+            i = self.index
+            self.index = (self.index + 1) % self.count
+            return i
+        # Loops, with the last frame shown for an average interval
+        duration = self.timestamps[-1] * len(self.timestamps) / max(1, len(self.timestamps) - 1)
+        elapsed = ((time.monotonic() - self.started) * self.speed) % max(duration, 1e-9)
+        return max(0, bisect.bisect_right(self.timestamps, elapsed) - 1)
+
+    @property
+    def frame_shape(self):
+        return (self.shape[1], self.shape[0], 3)
+
+    def capture_into(self, buffer):
+        np.copyto(buffer, self._decode(self._next_index()))
+
+    def capture_metadata(self):
+        return dict(ExposureTime=self.exposure, AnalogueGain=1.0, AeLocked=True)
+
+    def _stream_frame(self, i: int) -> bytes:
+        data = self._frame_bytes(i)
+        if simplejpeg.is_jpeg(data):
+            return bytes(data)
+        if i not in self._stream_cache:
+            # Same main/lores ratio as RPiCamera, encoded once per frame
+            if len(self._stream_cache) >= REPLAY_READAHEAD:
+                del self._stream_cache[next(iter(self._stream_cache))]
+            image = Image.open(io.BytesIO(data)).convert("RGB")
+            image = image.resize((self.shape[0] // 5, self.shape[1] // 5))
+            self._stream_cache[i] = simplejpeg.encode_jpeg(
+                np.asarray(image), quality=self.stream_quality
+            )
+        return self._stream_cache[i]
+
+    def start_stream(self, output):
+        self.is_streaming = True
+
+        def stream():
+            deadline = time.monotonic()
+            while self.is_streaming:
+                i = self._next_index()
+                output.write(self._stream_frame(i))
+                if self.realtime:
+                    deadline = time.monotonic() + 1 / self.fps
+                else:
+                    deadline += 1 / self.fps
+                time.sleep(max(0.0, deadline - time.monotonic()))
+
+        self.worker = Thread(target=stream, daemon=True)
+        self.worker.start()
+
+    def stop_stream(self):
+        self.is_streaming = False
+        self.worker.join()
+
+    def set_params(self, params):
+        msg = []
         if "name" in params:
             newname = str(params["name"])
             msg.append("name: %s > %s" % (self.name, newname))
             self.name = newname
+        if "speed" in params:
+            newspeed = float(params["speed"])
+            msg.append("speed: %f > %f" % (self.speed, newspeed))
+            self.speed = newspeed
         return "\n".join(msg)
 
 
 def _setup_camera() -> Camera:
-    """Statically called at run time"""
-    if sys.platform.startswith("linux"):
+    """Called once, on first use of camera_instance"""
+    import config
+
+    backend = config.CONFIG.camera_backend
+    options = config.CONFIG.camera_options
+    if backend == "rpi":
+        return RPiCamera()
+    elif backend == "dummy":
+        return DummyCamera()
+    elif backend == "synthetic":
+        return SyntheticCamera(**options)
+    elif backend == "replay":
+        return ReplayCamera(**options)
+    elif sys.platform.startswith("linux"):
         try:
             return RPiCamera()
         except:
@@ -181,10 +692,30 @@ def _setup_camera() -> Camera:
         return DummyCamera()
 
 
-camera_instance: Final[Camera] = _setup_camera()
+_camera_instance: Optional[Camera] = None
+_camera_lock = Lock()
+
+
+def get_camera() -> Camera:
+    """Sets the camera up on first call, concurrent callers wait for it."""
+    global _camera_instance
+    if _camera_instance is None:
+        with _camera_lock:
+            if _camera_instance is None:
+                _camera_instance = _setup_camera()
+    return _camera_instance
+
+
+def __getattr__(name):
+    # Keeps `cameras.camera_instance` working without setting the camera up
+    # as a side effect of importing this module
+    if name == "camera_instance":
+        return get_camera()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 if __name__=='__main__':
 	import matplotlib.pyplot as plt
-	snap = camera_instance.snap()
+	snap = get_camera().snap()
 	plt.imshow(snap)
 	plt.show()
@@ -0,0 +1,147 @@
+import asyncio
+from typing import Dict, Optional, Tuple
+import cameras
+import encoders
+from scheduler import CaptureSchedule
+
+# Seconds. Schedules falling due this close to a capture share its frame.
+DEFAULT_TOLERANCE = 1.0
+
+
+class CapturedFrame(cameras.Frame):
+    def __init__(self, frame: cameras.Frame, timestamp: float, seq: int):
+        super().__init__(frame.array, frame.camera)
+        # Event loop time the capture was started at
+        self.timestamp = timestamp
+        self.seq = seq
+
+
+class CaptureArbiter:
+    """Serializes access to the shared camera.
+
+    Callers that fall due within `tolerance` of a capture, either in flight or
+    just finished, get that capture's frame instead of triggering their own.
+    A schedule never gets the same frame twice, nor one from before it
+    started.
+    """
+
+    def __init__(self, tolerance: float = DEFAULT_TOLERANCE):
+        self.tolerance = tolerance
+        self.lock = asyncio.Lock()
+        self.last: Optional[CapturedFrame] = None
+        self.seq = 0
+        # Served the last finished capture / joined the one in flight /
+        # triggered a new one
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self._inflight: Optional[asyncio.Future] = None
+        self._inflight_started = 0.0
+
+    async def capture(self, due: Optional[float] = None, tolerance: Optional[float] = None, schedule: Optional[CaptureSchedule] = None, counts: Optional[Dict[str, int]] = None) -> CapturedFrame:
+        """Returns a frame captured no earlier than `due - tolerance`.
+
+        `due` is in event loop time and defaults to now. With a schedule, the
+        tolerance is at most half its interval and the frame is newer than
+        the schedule's start and the last frame it got. `counts` gets the
+        caller's own hits, coalesced and misses on top of the totals.
+        """
+        loop = asyncio.get_running_loop()
+        due = loop.time() if due is None else due
+        tolerance = self.tolerance if tolerance is None else tolerance
+        last_seq = 0
+        if schedule is not None:
+            tolerance = min(tolerance, schedule.interval / 2)
+            last_seq = schedule.last_seq
+        oldest = due - tolerance
+        if schedule is not None:
+            oldest = max(oldest, schedule.start)
+
+        if self._inflight is not None and self._inflight_started >= oldest:
+            self.coalesced += 1
+            if counts is not None:
+                counts["coalesced"] += 1
+            frame = await asyncio.shield(self._inflight)
+        else:
+            frame = await self._capture(loop, oldest, last_seq, counts)
+        if schedule is not None:
+            schedule.last_seq = frame.seq
+        return frame
+
+    async def _capture(self, loop: asyncio.AbstractEventLoop, oldest: float, last_seq: int, counts: Optional[Dict[str, int]]) -> CapturedFrame:
+        async with self.lock:
+            if self.last is not None and self.last.timestamp >= oldest and self.last.seq > last_seq:
+                self.hits += 1
+                if counts is not None:
+                    counts["hits"] += 1
+                return self.last
+
+            self._inflight = future = loop.create_future()
+            self._inflight_started = started = loop.time()
+            try:
+                # Resolved off the loop, the camera may still be setting up
+                camera = await asyncio.to_thread(cameras.get_camera)
+                frame = await asyncio.to_thread(camera.snap_frame)
+            except Exception as e:
+                future.set_exception(e)
+                # Waiters get it re-raised, don't warn if there are none
+                future.exception()
+                raise
+            except BaseException:
+                # Cancelled, don't leave the coalesced waiters hanging
+                future.cancel()
+                raise
+            finally:
+                self._inflight = None
+
+            self.seq += 1
+            self.misses += 1
+            if counts is not None:
+                counts["misses"] += 1
+            self.last = CapturedFrame(frame, started, self.seq)
+            future.set_result(self.last)
+            return self.last
+
+
+class SnapService:
+    """Serves /camera snap requests.
+
+    Concurrent requests share one capture, requests within `freshness`
+    seconds of the last capture reuse it, and each frame is encoded at most
+    once per format and quality.
+    """
+
+    def __init__(self, arbiter: CaptureArbiter, freshness: float):
+        self.arbiter = arbiter
+        self.freshness = freshness
+        # Encodings of the latest frame only, by (format, quality), quality is
+        # None for lossless formats
+        self._encoded_seq = 0
+        self._encoded: Dict[Tuple[str, int], asyncio.Future] = {}
+        # Of snap requests only, the arbiter's totals include timelapses
+        self.counts = dict(hits=0, coalesced=0, misses=0)
+
+    async def snap(self, format: str = encoders.DEFAULT_FORMAT, quality: int = encoders.DEFAULT_QUALITY) -> Tuple[CapturedFrame, bytes]:
+        frame = await self.arbiter.capture(tolerance=self.freshness, counts=self.counts)
+        if frame.seq != self._encoded_seq:
+            self._encoded_seq = frame.seq
+            self._encoded = {}
+        key = (format, quality if encoders.ENCODERS[format].lossy else None)
+        future = self._encoded.get(key)
+        if future is None:
+            self._encoded[key] = future = asyncio.get_running_loop().create_future()
+            try:
+                future.set_result(
+                    await asyncio.to_thread(encoders.encode, frame.rgb, format, quality)
+                )
+            except Exception as e:
+                future.set_exception(e)
+                if self._encoded.get(key) is future:
+                    del self._encoded[key]
+                future.exception()
+                raise
+        return frame, await asyncio.shield(future)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counts)
@@ -0,0 +1,165 @@
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import constants
+import journal
+import uploads
+
+# Characters after which a match counts as the start of a word
+WORD_SEPARATORS = " -_."
+
+
+@dataclass
+class TimelapseSummary:
+    name: str
+    # Frames kept, per the journal, or PNGs on disk without one
+    frames: int
+    # Bytes of every file under the timelapse directory
+    size: int
+    start_time: Optional[str]
+    # Files recorded as on Drive in the remote manifest
+    uploaded: int
+
+
+def _mtime(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _walk(dir: str) -> Tuple[int, int]:
+    """Total size and PNG count of the files under dir."""
+    size = pngs = 0
+    stack = [dir]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    size += entry.stat(follow_symlinks=False).st_size
+                    pngs += entry.name.endswith(".png")
+    return size, pngs
+
+
+def rank(query: str, name: str) -> Optional[Tuple[int, int]]:
+    """Sort key of a match of the lowercased query in the lowercased name,
+    exact before prefix before word start before anywhere. None if the name
+    does not match."""
+    position = name.find(query)
+    if position < 0:
+        return None
+    if name == query:
+        return 0, 0
+    if position == 0:
+        return 1, 0
+    if name[position - 1] in WORD_SEPARATORS:
+        return 2, position
+    return 3, position
+
+
+class TimelapseCatalog:
+    """In-memory index of the timelapses on disk.
+
+    Names are rescanned only when the timelapses directory's mtime changes,
+    i.e. a timelapse was added, deleted or renamed. Summaries are cached per
+    timelapse and recomputed when the mtime of its directory, frames,
+    journal or remote manifest changes, so only ones still being written to
+    get walked again.
+    """
+
+    def __init__(self, dir: str = constants.TIMELAPSES_DIR):
+        self.dir = dir
+        self.mtime = None
+        # Sorted, with their lowercased form for matching
+        self.names: List[Tuple[str, str]] = []
+        self.summaries: Dict[str, Tuple[Tuple[int, ...], TimelapseSummary]] = {}
+        # Summaries are computed on a worker thread while autocomplete
+        # refreshes on the loop. Held for the bookkeeping only, not the walks.
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        with self.lock:
+            mtime = _mtime(self.dir)
+            if mtime == self.mtime:
+                return
+            self.mtime = mtime
+            names = []
+            if os.path.isdir(self.dir):
+                with os.scandir(self.dir) as entries:
+                    names = sorted(entry.name for entry in entries if entry.is_dir())
+            self.names = [(name, name.lower()) for name in names]
+            for name in set(self.summaries).difference(names):
+                del self.summaries[name]
+
+    def list(self) -> List[str]:
+        self.refresh()
+        return [name for name, _ in self.names]
+
+    def search(self, query: str, limit: int = 25) -> List[str]:
+        """Names matching the query case-insensitively, best matches first."""
+        self.refresh()
+        query = query.lower()
+        if not query:
+            return [name for name, _ in self.names[:limit]]
+        matches = []
+        for name, lower in self.names:
+            key = rank(query, lower)
+            if key is not None:
+                matches.append((key, len(name), name))
+        matches.sort()
+        return [name for _, _, name in matches[:limit]]
+
+    def summary(self, name: str) -> TimelapseSummary:
+        """Summary of a timelapse, blocking if it has to be recomputed."""
+        dir = os.path.join(self.dir, name)
+        key = (
+            _mtime(dir),
+            _mtime(os.path.join(dir, "frames")),
+            _mtime(os.path.join(dir, journal.JOURNAL_FILE)),
+            _mtime(os.path.join(dir, uploads.MANIFEST_FILE)),
+        )
+        with self.lock:
+            cached = self.summaries.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        size, pngs = _walk(dir)
+        try:
+            metadata = journal.load_metadata(dir)
+        except (OSError, ValueError):
+            metadata = {}
+        summary = TimelapseSummary(
+            name=name,
+            frames=len(metadata["timestamps"]) if "timestamps" in metadata else pngs,
+            size=size,
+            start_time=metadata.get("start_time"),
+            uploaded=len(uploads.RemoteManifest(dir).files),
+        )
+        with self.lock:
+            self.summaries[name] = (key, summary)
+        return summary
+
+    def summarize(self) -> List[TimelapseSummary]:
+        """Summaries of every timelapse, newest first. Blocking."""
+        summaries = [self.summary(name) for name in self.list()]
+        summaries.sort(key=lambda summary: summary.start_time or "", reverse=True)
+        return summaries
+
+    def upload_status(self, summary: TimelapseSummary, queue: uploads.UploadQueue) -> str:
+        manifest = os.path.normpath(os.path.join(self.dir, summary.name, uploads.MANIFEST_FILE))
+        if any(job.manifest and os.path.normpath(job.manifest) == manifest for job in queue.jobs.values()):
+            return "uploading"
+        if summary.uploaded:
+            return "uploaded"
+        return "local only"
+
+
+def format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1000:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1000
+    return f"{size:.1f} TB"
@@ -0,0 +1,48 @@
+from typing import Optional, Tuple
+import numpy as np
+
+# Blocks along the short side of the thumbnail frames are compared at
+THUMBNAIL_SIZE = 64
+# Pixels sampled along each side of a block. Averaging a strided subset
+# costs a fraction of the full frame and is as good at suppressing noise.
+BLOCK_SAMPLES = 4
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def thumbnail(rgb: np.ndarray, size: int = THUMBNAIL_SIZE) -> np.ndarray:
+    """Block averaged grayscale of an HxWx3 uint8 frame, about `size`
+    blocks along its short side, float32 in 0..1."""
+    height, width = rgb.shape[:2]
+    block = max(1, min(height, width) // size)
+    step = max(1, block // BLOCK_SAMPLES)
+    rows, columns = height // block, width // block
+    # Splitting the axes is a view, only the sampled pixels get converted
+    blocks = rgb[:rows * block, :columns * block].reshape(rows, block, columns, block, -1)
+    gray = blocks[:, ::step, :, ::step].astype(np.float32) @ LUMA
+    return gray.mean(axis=(1, 3)) / 255
+
+
+class ChangeDetector:
+    """Decides whether a timelapse frame is worth keeping.
+
+    A frame is kept if its mean absolute difference from the last kept
+    frame, compared as thumbnails, is at least `threshold` percent of full
+    scale. The first frame is always kept.
+    """
+
+    def __init__(self, threshold: float, size: int = THUMBNAIL_SIZE):
+        self.threshold = threshold
+        self.size = size
+        self.reference: Optional[np.ndarray] = None
+
+    def check(self, rgb: np.ndarray) -> Tuple[bool, float]:
+        """Returns whether to keep the frame and its change in percent."""
+        current = thumbnail(rgb, self.size)
+        if self.reference is None or self.reference.shape != current.shape:
+            self.reference = current
+            return True, 100.0
+        change = float(np.abs(current - self.reference).mean()) * 100
+        if change >= self.threshold:
+            self.reference = current
+            return True, change
+        return False, change
@@ -1,9 +1,9 @@
 import asyncio
 import datetime
 import io
-import json
 import os
 import shutil
+import tempfile
 import time
 import typing
 import discord
@@ -12,26 +12,54 @@ import constants
 from bot import CameraBot
 import helpers
 from views.confirm_view import ConfirmView
+from views.page_view import PageView
+from reactionmenu import ViewMenu, ViewButton
 from config import CONFIG
 from cogs import BaseCog
 import ffmpeg
 import cameras
+import video
+import encoders
+import archive
+import uploads
+from journal import TimelapseJournal
+from scheduler import CaptureSchedule
+from capture import CaptureArbiter, SnapService
+from changes import ChangeDetector
+from catalog import TimelapseCatalog, format_size
 
 class CameraCog(BaseCog):
-    progress: int
-    total: int
-    is_timelapse_active = False
+    timelapses: typing.Dict[str, CaptureSchedule]
+    renders: typing.Dict[str, video.SegmentedEncode]
     camera_group = app_commands.Group(name="camera", description="Camera")
     timelapse_group = app_commands.Group(name="timelapse", description="Timelapse")
 
     camera_group.add_command(timelapse_group)
 
+    def __init__(self, bot: CameraBot):
+        super().__init__(bot)
+        # Active timelapses by name
+        self.timelapses = {}
+        # Timelapses done capturing whose video is being encoded, by name
+        self.renders = {}
+        self.arbiter = CaptureArbiter()
+        self.snaps = SnapService(self.arbiter, CONFIG.snap_freshness)
+        self.catalog = TimelapseCatalog()
+
     async def timelapses_names_autocompletion(
         self, interaction: discord.Interaction, current: str
     ) -> typing.List[app_commands.Choice[str]]:
         return [
             app_commands.Choice(name=choice, value=choice)
-            for choice in helpers.get_autocomplete(current, helpers.list_timelapses())
+            for choice in self.catalog.search(current)
+        ]
+
+    async def active_timelapses_autocompletion(
+        self, interaction: discord.Interaction, current: str
+    ) -> typing.List[app_commands.Choice[str]]:
+        return [
+            app_commands.Choice(name=choice, value=choice)
+            for choice in helpers.get_autocomplete(current, [*self.timelapses, *self.renders])
         ]
 
     @app_commands.describe(
@@ -98,7 +126,12 @@ class CameraCog(BaseCog):
                     )
 
     @app_commands.describe(
-        interval="Time interval in seconds.", count="Number of snaps.", name="Name of timelapse."
+        interval="Time interval in seconds.",
+        count="Number of snaps.",
+        name="Name of timelapse.",
+        live_encode="Encode the video while capturing? Defaults to false.",
+        keep_frames="Keep every frame as PNG when live encoding? Defaults to true.",
+        min_change="Skip frames that changed less than this percent since the last kept one. Defaults to 0, keeping all.",
     )
     @timelapse_group.command(name="start")
     async def timelapse_start(
@@ -107,12 +140,14 @@ class CameraCog(BaseCog):
         interval: int,
         count: int,
         name: str,
+        live_encode: typing.Optional[bool] = False,
+        keep_frames: typing.Optional[bool] = True,
+        min_change: typing.Optional[app_commands.Range[float, 0, 100]] = 0.0,
     ):
-        """Start a timelapse. Only one timelapse can be running at a time."""
-        # Only allow one for now
-        if self.is_timelapse_active:
+        """Start a timelapse. Several can run at once, sharing captures."""
+        if name in self.timelapses:
             await interaction.response.send_message(
-                "Failed to start. There is currently an active timelapse."
+                "Failed to start. A timelapse with this name is already active."
             )
         elif os.path.isdir(f"{constants.TIMELAPSES_DIR}/{name}"):
             await interaction.response.send_message(
@@ -120,7 +155,7 @@ class CameraCog(BaseCog):
             )
         else:
             total_time = interval * count
-            self.eta = total_time 
+            self.timelapses[name] = schedule = CaptureSchedule(interval, count)
             async def timelapse_task():
                 try:
                     await self.bot.wait_until_ready()
@@ -130,92 +165,168 @@ class CameraCog(BaseCog):
 
                     dir = os.path.join(constants.TIMELAPSES_DIR, name)
                     frames_dir = os.path.join(dir, "frames")
-                    self.is_timelapse_active = True
+                    video_path = f"{dir}/timelapse.mp4"
+                    # Frames are what the video gets built from otherwise
+                    save_frames = keep_frames or not live_encode
+                    encoder = video.LiveEncoder(video_path) if live_encode else None
+                    journal = None
+                    sync = None
+                    frame_size = None
+                    detector = ChangeDetector(min_change) if min_change else None
+                    # Frames kept, numbered without gaps for ffmpeg
+                    kept = 0
 
-                    SLEEP_TIME = 0.1
                     try:
                         if not os.path.isdir(dir):
                             os.makedirs(dir)
                             os.makedirs(frames_dir)
 
-                        metadata = cameras.camera_instance.metadata
+                        # May still be setting up in the background
+                        camera = await asyncio.to_thread(cameras.get_camera)
+                        metadata = camera.metadata
                         t0 = time.time()
                         metadata["start_time"] = str(datetime.datetime.fromtimestamp(t0))
                         metadata["interval"] = interval
-                        metadata["timestamps"] = []
-
-                        for i in range(count):
-                            self.progress = i
-                            time_up = i * interval
-                            while True:
-                                # Relinquish control
-                                await asyncio.sleep(SLEEP_TIME)
-                                dt = time.time() - t0
-                                self.eta -= dt
-                                if dt >= time_up:
-                                    break
-                                if not self.is_timelapse_active:
-                                    if os.path.isdir(dir):
-                                        shutil.rmtree(dir)
-                                    return
-                            snap = await asyncio.to_thread(cameras.camera_instance.snap)
-                            await asyncio.to_thread(snap.save, f"{frames_dir}/{i}.png")
-                            metadata["snaps"] = i
-                            metadata["timestamps"] += [dt]
-                            with open(f"{dir}/metadata.json", "wt", encoding="utf-8") as f:
-                                json.dump(metadata, f, ensure_ascii=False, indent=4)
-
-                        self.is_timelapse_active = False
+                        metadata["min_change"] = min_change
+                        journal = await asyncio.to_thread(
+                            TimelapseJournal, dir, metadata
+                        )
+                        if CONFIG.drive_sync_mode == "incremental":
+                            sync = uploads.TimelapseSync(
+                                self.bot.uploads, dir, name, CONFIG.drive_folder_id
+                            )
+                            # Frames go straight into it as they are saved,
+                            # once it exists. Drive being slow or unreachable
+                            # doesn't hold up capturing.
+                            sync.prepare("frames")
+
+                        schedule.begin()
+                        # Only wakes up when a capture is due
+                        async for i in schedule:
+                            # Shared with any other timelapse due around now
+                            frame = await self.arbiter.capture(schedule.deadline(i), schedule=schedule)
+                            dt = frame.timestamp - schedule.start
+                            if detector:
+                                keep, change = await asyncio.to_thread(detector.check, frame.rgb)
+                                if not keep:
+                                    await asyncio.to_thread(journal.skip, i, dt, change=round(change, 3))
+                                    schedule.captured(i, frame.timestamp)
+                                    continue
+                            if encoder:
+                                await asyncio.to_thread(encoder.write, frame.rgb)
+                            if save_frames:
+                                await asyncio.to_thread(frame.image.save, f"{frames_dir}/{kept}.png")
+                                if sync:
+                                    sync.add(f"{frames_dir}/{kept}.png")
+                            await asyncio.to_thread(journal.append, i, dt, frame=kept)
+                            schedule.captured(i, frame.timestamp)
+                            frame_size = frame.size
+                            kept += 1
+
+                        await asyncio.to_thread(journal.close)
+                        self.timelapses.pop(name, None)
+                        if schedule.cancelled:
+                            if encoder:
+                                await asyncio.to_thread(encoder.abort)
+                            if sync:
+                                sync.cancel()
+                            if os.path.isdir(dir):
+                                shutil.rmtree(dir)
+                            return
                     except Exception as e:
-                        self.is_timelapse_active = False
-                        if os.path.isdir(dir):
-                            shutil.rmtree(dir)
+                        # Frames and the fragmented video so far are kept,
+                        # only a cancel deletes them
+                        self.timelapses.pop(name, None)
+                        if journal:
+                            await asyncio.to_thread(journal.close)
+                        if encoder:
+                            try:
+                                # Ends the last fragment cleanly
+                                await asyncio.to_thread(encoder.close)
+                            except Exception:
+                                await asyncio.to_thread(encoder.abort)
+                        if sync:
+                            sync.cancel()
                         raise e
-                    
-                    video_path = f"{dir}/timelapse.mp4"
+
                     try:
-                        (
-                            ffmpeg
-                            .input(f"{frames_dir}/%d.png")
-                            .output(
-                                video_path,
-                                framerate=30,
-                                vcodec="libx264",
-                                crf=17,
-                                pix_fmt="yuv420p"
-                            )
-                            .overwrite_output()
-                            .run(capture_stdout=True, capture_stderr=True)
-                        )
+                        if encoder:
+                            await asyncio.to_thread(encoder.close)
+                        else:
+                            render = video.SegmentedEncode(frames_dir, video_path)
+                            self.renders[name] = render
+                            try:
+                                await render.run()
+                            except asyncio.CancelledError:
+                                if not render.cancelled:
+                                    raise
+                                # Frames are kept, the cancel command posts
+                                # the message
+                                return
+                            finally:
+                                self.renders.pop(name, None)
                     except ffmpeg.Error:
                         await channel.send(
                             f"{user.mention} Failed to create timelapse video from frames."
                         )
 
-                    path = await asyncio.to_thread(
-                        shutil.make_archive,
-                        name,
-                        "zip",
-                        constants.TIMELAPSES_DIR,
-                        name
-                    )
-                    await asyncio.to_thread(helpers.upload_to_google_folder,
-                        f"{name}.zip",
-                        CONFIG.drive_folder_id,
-                        path
-                    )
-                    os.remove(path)
+                    # Uploads in the background, and survives a restart
+                    if sync:
+                        # Frames are up or queued already, this adds the
+                        # video, metadata and any frame that failed
+                        try:
+                            await sync.prepared()
+                            paths = await asyncio.to_thread(sync.walk)
+                        except Exception as e:
+                            uploads.logger.warning(
+                                f"Could not create the Drive folders of '{name}', it will be archived instead: {e!r}"
+                            )
+                            sync.cancel()
+                            sync = None
+                        else:
+                            for path in paths:
+                                sync.add(path)
+                            link = sync.url
+                    if not sync:
+                        path = await asyncio.to_thread(archive.archive_timelapse, name)
+                        self.bot.uploads.put(
+                            path, f"{name}.zip", CONFIG.drive_folder_id, delete_after=True,
+                            manifest=os.path.join(dir, uploads.MANIFEST_FILE), key=f"{name}.zip",
+                        )
+                        link = f"https://drive.google.com/drive/folders/{CONFIG.drive_folder_id}?usp=sharing"
 
-                    # in MB
-                    size = os.stat(video_path).st_size / (1024 * 1024)
-                    msg = f"{user.mention} '{name}' timelapse has finished: https://drive.google.com/drive/folders/{CONFIG.drive_folder_id}?usp=sharing"
-                    if size >= 25:
+                    msg = f"{user.mention} '{name}' timelapse has finished: {link}"
+                    if detector:
+                        msg += f" Kept {kept} of {schedule.completed} frames, the rest did not change enough."
+                    if not os.path.exists(video_path):
+                        # Encoding failed, reported above
                         await channel.send(msg)
-                    else:
+                    elif os.stat(video_path).st_size <= encoders.ATTACHMENT_LIMIT:
                         await channel.send(msg, file=discord.File(video_path))
+                    else:
+                        # Drive keeps the full quality video, Discord gets
+                        # a copy encoded to fit
+                        with tempfile.TemporaryDirectory() as tmp:
+                            preview_path = os.path.join(tmp, "timelapse.mp4")
+                            try:
+                                fits = await video.encode_preview(
+                                    video_path,
+                                    preview_path,
+                                    frame_size,
+                                    kept,
+                                    encoders.ATTACHMENT_LIMIT,
+                                )
+                            except ffmpeg.Error:
+                                fits = False
+                            if fits:
+                                await channel.send(msg, file=discord.File(preview_path))
+                            else:
+                                await channel.send(msg)
                 except Exception as e:
+                    self.timelapses.pop(name, None)
                     await channel.send(
-                        f"{user.mention} An error has occurred with the timelapse."
+                        f"{user.mention} An error has occurred with timelapse '{name}'. "
+                        "What was captured is kept on local drive."
                     )
                     await self.bot.log_error(e)
             
@@ -223,35 +334,68 @@ class CameraCog(BaseCog):
 
             await interaction.response.send_message(f"Timelapse '{name}' has started. ETA: {datetime.timedelta(seconds=total_time)}")
 
+    @app_commands.describe(
+        name="Name of timelapse"
+    )
+    @app_commands.autocomplete(name=active_timelapses_autocompletion)
     @timelapse_group.command(name="cancel")
-    async def timelapse_cancel(self, interaction: discord.Interaction):
-        """Cancels current running timelapse."""
+    async def timelapse_cancel(self, interaction: discord.Interaction, name: str):
+        """Cancels a running timelapse."""
         view = ConfirmView()
 
         await interaction.response.send_message(
-            "Are you sure you want to cancel the timelapse?", view=view, ephemeral=True
+            f"Are you sure you want to cancel timelapse '{name}'?", view=view, ephemeral=True
         )
         if not await view.wait(interaction):
             if view.value:
-                if self.is_timelapse_active:
-                    self.is_timelapse_active = False
+                schedule = self.timelapses.pop(name, None)
+                render = self.renders.pop(name, None)
+                if schedule:
+                    schedule.cancel()
+                    await interaction.followup.send(
+                        f"Timelapse '{name}' was canceled by {interaction.user.mention}."
+                    )
+                elif render:
+                    render.cancel()
                     await interaction.followup.send(
-                        f"Timelapse was canceled by {interaction.user.mention}."
+                        f"Video of timelapse '{name}' was canceled by {interaction.user.mention}. Its frames were kept."
                     )
                 else:
                     await interaction.followup.send(
-                        "There was no active timelapse to cancel.",
+                        f"There is no active timelapse '{name}' to cancel.",
                         ephemeral=True
                     )
 
+    @app_commands.describe(
+        name="Name of timelapse. Defaults to all active timelapses."
+    )
+    @app_commands.autocomplete(name=active_timelapses_autocompletion)
     @timelapse_group.command(name="progress")
-    async def timelapse_progress(self, interaction: discord.Interaction):
-        """Get progress of timelapse."""
-        if self.is_timelapse_active:
+    async def timelapse_progress(
+        self,
+        interaction: discord.Interaction,
+        name: typing.Optional[str] = None
+    ):
+        """Get progress of timelapses."""
+        if name is not None and name not in self.timelapses and name not in self.renders:
             await interaction.response.send_message(
-                f"{self.progress}/{self.total} completed. ETA: {datetime.timedelta(seconds=self.eta)}",
-                ephemeral=True
+                f"There is no active timelapse '{name}'.", ephemeral=True
             )
+        elif self.timelapses or self.renders:
+            names = [name] if name is not None else [*self.timelapses, *self.renders]
+            lines = []
+            for name in names:
+                if name in self.renders:
+                    lines.append(f"'{name}': encoding video, {self.renders[name].progress:.0%} done.")
+                    continue
+                schedule = self.timelapses[name]
+                lines.append(
+                    f"'{name}': {schedule.completed}/{schedule.count} completed. "
+                    f"ETA: {datetime.timedelta(seconds=round(schedule.eta))}. "
+                    f"Capture jitter: {schedule.mean_jitter * 1000:.0f} ms mean, "
+                    f"{schedule.max_jitter * 1000:.0f} ms max."
+                )
+            await interaction.response.send_message("\n".join(lines), ephemeral=True)
         else:
             await interaction.response.send_message(
                 "There is no active timelapse.", ephemeral=True
@@ -259,39 +403,84 @@ class CameraCog(BaseCog):
 
     @timelapse_group.command(name="list")
     async def timelapse_list(self, interaction: discord.Interaction):
-        """Get link to timelapses."""
-        await interaction.response.send_message(
-            f"https://drive.google.com/drive/folders/{CONFIG.drive_folder_id}?usp=sharing.",
-            ephemeral=True,
-        )
+        """List timelapses on local drive, with a link to the uploaded ones."""
+        # Summarizing walks every timelapse on a cold cache, which can take
+        # longer than the interaction deadline
+        await interaction.response.defer(ephemeral=True)
+        summaries = await asyncio.to_thread(self.catalog.summarize)
+        link = f"https://drive.google.com/drive/folders/{CONFIG.drive_folder_id}?usp=sharing"
+        if not summaries:
+            await interaction.followup.send(
+                f"There are no timelapses on local drive. Uploaded ones: {link}", ephemeral=True
+            )
+            return
+
+        lines = []
+        for summary in summaries:
+            if summary.name in self.timelapses:
+                status = "capturing"
+            elif summary.name in self.renders:
+                status = "encoding"
+            else:
+                status = self.catalog.upload_status(summary, self.bot.uploads)
+            lines.append(
+                f"**{summary.name}**: {summary.frames} frames, {format_size(summary.size)}, "
+                f"started {summary.start_time or 'unknown'}, {status}"
+            )
+
+        # 10 timelapses per page
+        ITEMS_PER_PAGE = 10
+        menu = PageView(interaction, menu_type=ViewMenu.TypeEmbed)
+        for x in range(0, len(lines), ITEMS_PER_PAGE):
+            menu.add_page(
+                discord.Embed(
+                    title="Timelapses",
+                    url=link,
+                    description="\n".join(lines[x : x + ITEMS_PER_PAGE]),
+                ).set_footer(text=f"{len(lines)} timelapses on local drive")
+            )
+        menu.add_button(ViewButton.back())
+        menu.add_button(ViewButton.next())
+        await menu.start()
 
 
     @app_commands.describe(
-        private="Privately send? Defaults to true."
+        private="Privately send? Defaults to true.",
+        format="Image format. Defaults to jpeg.",
+        quality="Quality for jpeg and webp, 1-100. Defaults to 90.",
     )
     @camera_group.command(name="snap")
     async def snap(
         self,
         interaction: discord.Interaction,
-        private: typing.Optional[bool] = True
+        private: typing.Optional[bool] = True,
+        format: typing.Optional[typing.Literal["jpeg", "webp", "png"]] = encoders.DEFAULT_FORMAT,
+        quality: typing.Optional[app_commands.Range[int, 1, 100]] = encoders.DEFAULT_QUALITY,
     ):
         """Gets a snap from the camera."""
-        import cameras
-
         await interaction.response.send_message("Please wait... This message will be updated with the snap.", ephemeral=private)
 
-        snap = await asyncio.to_thread(cameras.camera_instance.snap)
-        buffer = io.BytesIO()
+        _, data = await self.snaps.snap(format, quality)
 
-        # Hardcoding ext for now
-        with io.BytesIO() as buffer:
-            await asyncio.to_thread(snap.save, buffer, "PNG", optimize=True)
-            buffer.seek(0)
+        with io.BytesIO(data) as buffer:
             await interaction.edit_original_response(
                 content="",
-                attachments=[discord.File(fp=buffer, filename="snap.png")]
+                attachments=[
+                    discord.File(fp=buffer, filename=f"snap.{encoders.ENCODERS[format].ext}")
+                ]
             )
 
+    @camera_group.command(name="stats")
+    async def camera_stats(self, interaction: discord.Interaction):
+        """Get snap cache statistics."""
+        stats = self.snaps.stats
+        await interaction.response.send_message(
+            f"Snaps served from cache: {stats['hits']}, "
+            f"joined an in-flight capture: {stats['coalesced']}, "
+            f"new captures: {stats['misses']}.",
+            ephemeral=True,
+        )
+
     @camera_group.command(name="feed")
     async def camera_feed(self, interaction: discord.Interaction):
         """Get link to camera feed. Can only view on local network."""
@@ -1,7 +1,7 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import dataclasses
 import json
-from typing import Final, List
+from typing import Any, Dict, Final, List, Optional
 
 from dataclasses_json import dataclass_json
 
@@ -15,6 +15,28 @@ class Config:
     dev_channel_id: int
     drive_folder_id: str
     owners: List[int]
+    # "flask" runs the web app in its own thread, "aiohttp" serves it from the
+    # bot's event loop
+    stream_server: str = "flask"
+    # Seconds a snap is served to /camera snap requests before a new capture
+    snap_freshness: float = 2.0
+    # "auto", "rpi", "dummy", "synthetic" or "replay", see
+    # cameras._setup_camera. camera_options are passed to the synthetic and
+    # replay cameras' constructors.
+    camera_backend: str = "auto"
+    camera_options: Dict[str, Any] = field(default_factory=dict)
+    # Drive uploads, see uploads.UploadQueue. The chunk size must be a
+    # multiple of 256 KiB.
+    upload_chunk_size: int = 8 * 1024 * 1024
+    upload_concurrency: int = 1
+    # Overrides https://www.googleapis.com/, e.g. to point at a local fake
+    # Drive server. Requests then go unauthenticated.
+    drive_api_endpoint: Optional[str] = None
+    # "archive" uploads a zip of the timelapse when it finishes, "incremental"
+    # uploads frames to a folder per timelapse as they are captured
+    drive_sync_mode: str = "archive"
+    # "text" or "json", one object per line, for data/logs/discord.log
+    log_format: str = "text"
 
     def update(self):
         with open("config.json", mode="wt") as fs:
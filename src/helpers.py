@@ -1,6 +1,5 @@
 import asyncio
 import io
-import pathlib
 import shutil
 import subprocess
 import sys
@@ -21,13 +20,6 @@ def list_cogs():
         if file.endswith(".py") and not file.startswith("__init__")
     ]
 
-def list_timelapses():
-    return [
-        timelapse
-        for timelapse in os.listdir(constants.TIMELAPSES_DIR)
-    ]
-
-
 def restart():
     os.execv(sys.executable, ["python"] + sys.argv)
 
@@ -63,44 +55,13 @@ async def async_update(branch: str):
         if os.path.exists(TMP_DIR):
             shutil.rmtree(TMP_DIR)
 
-def get_timelapse_data(name):
-    buffer = io.BytesIO()
-    dir = pathlib.Path(f"{constants.TIMELAPSES_DIR}/{name}/")
-    with zipfile.ZipFile(buffer, "a", zipfile.ZIP_DEFLATED, False) as archive:
-        for path in dir.iterdir():
-            with open(path, mode="rb") as fs:
-                archive.writestr(path.name, fs.read())
-    buffer.seek(0)
-    return buffer
-
-
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-from google.oauth2 import service_account
-
-def upload_to_google_folder(filename: str, folder_id: str, path: str):
-    SCOPES = ['https://www.googleapis.com/auth/drive']
-    SERVICE_ACCOUNT_FILE = 'google_service.json'
-
-    creds = service_account.Credentials.from_service_account_file(
-            SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-
-    # create drive api client
-    service = build('drive', 'v3', credentials=creds)
-    # media = MediaIoBaseUpload(buffer, mimetype="application/zip", resumable=True)
-    # request = service.files().create(
-    #     media_body=media,
-    #     body={'name': filename, 'parents': [folder_id]}
-    # )
-    media = MediaFileUpload(path, resumable=True)
-    request = service.files().create(
-        media_body=media,
-        body={'name': filename, 'parents': [folder_id]},
-    )
+def import_google_client():
+    """The Google client takes seconds to import, so it is only imported on
+    first use or warmed up in the background at startup."""
+    import googleapiclient.discovery  # noqa: F401
+    import googleapiclient.http  # noqa: F401
+    import google.oauth2.service_account  # noqa: F401
 
-    response = None
-    while response is None:
-        _, response = request.next_chunk()
 
 def move_dir(src, dest):
     for dir in os.listdir(src):
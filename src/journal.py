@@ -0,0 +1,94 @@
+import json
+import os
+from typing import Dict, List
+
+METADATA_FILE = "metadata.json"
+JOURNAL_FILE = "frames.jsonl"
+# Frames between metadata.json rewrites
+CHECKPOINT_INTERVAL = 100
+# Per-frame lists, only written to metadata.json on close. The journal has
+# them until then.
+FRAME_LISTS = ("timestamps", "skipped")
+
+
+class TimelapseJournal:
+    """Append-only per-frame log of a timelapse.
+
+    Every frame is one JSON line in frames.jsonl. metadata.json only gets
+    rewritten at checkpoints, without the per-frame lists, and in full on
+    close, so the cost of a frame stays constant no matter how long the run
+    is.
+    """
+
+    def __init__(self, dir: str, metadata: Dict, checkpoint_interval: int = CHECKPOINT_INTERVAL):
+        self.dir = dir
+        self.metadata = metadata
+        # Of the frames kept, in file order, and of the ones skipped
+        self.metadata.setdefault("timestamps", [])
+        self.metadata.setdefault("skipped", [])
+        self.checkpoint_interval = checkpoint_interval
+        self.pending = 0
+        self.fs = open(os.path.join(dir, JOURNAL_FILE), "at", encoding="utf-8")
+        self.checkpoint()
+
+    def append(self, index: int, timestamp: float, **extra):
+        self.metadata["snaps"] = index
+        self.metadata["timestamps"].append(timestamp)
+        self._write(dict(i=index, t=timestamp, **extra))
+
+    def skip(self, index: int, timestamp: float, **extra):
+        """Records a capture that was not kept, so playback timing can still
+        be rebuilt."""
+        self.metadata["snaps"] = index
+        self.metadata["skipped"].append(timestamp)
+        self._write(dict(i=index, t=timestamp, skipped=True, **extra))
+
+    def _write(self, record: Dict):
+        self.fs.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.fs.flush()
+        self.pending += 1
+        if self.pending >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self, full: bool = False):
+        metadata = self.metadata
+        if not full:
+            metadata = {k: v for k, v in metadata.items() if k not in FRAME_LISTS}
+        path = os.path.join(self.dir, METADATA_FILE)
+        with open(f"{path}.tmp", "wt", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(f"{path}.tmp", path)
+        self.pending = 0
+
+    def close(self):
+        if not self.fs.closed:
+            self.fs.close()
+            self.checkpoint(full=True)
+
+
+def read_journal(dir: str) -> List[Dict]:
+    path = os.path.join(dir, JOURNAL_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, "rt", encoding="utf-8") as fs:
+        # A crash can leave the last line half written
+        records = []
+        for line in fs:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+        return records
+
+
+def load_metadata(dir: str) -> Dict:
+    """Rebuilds the full metadata of a timelapse, including frames written
+    after the last checkpoint."""
+    with open(os.path.join(dir, METADATA_FILE), "rt", encoding="utf-8") as fs:
+        metadata = json.load(fs)
+    records = read_journal(dir)
+    if records:
+        metadata["snaps"] = records[-1]["i"]
+        metadata["timestamps"] = [record["t"] for record in records if not record.get("skipped")]
+        metadata["skipped"] = [record["t"] for record in records if record.get("skipped")]
+    return metadata
@@ -0,0 +1,114 @@
+import copy
+import datetime
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+
+MAX_BYTES = 500 * 1000
+BACKUP_COUNT = 5
+# Records written between flushes when the queue never drains
+BATCH_SIZE = 256
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log processors."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = dict(
+            time=datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            level=record.levelname,
+            logger=record.name,
+            thread=record.threadName,
+            message=record.getMessage(),
+        )
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class CompressingFileHandler(logging.handlers.RotatingFileHandler):
+    """Rotating file handler that gzips rotated files and leaves flushing to
+    the caller, so a batch of records costs one write to disk."""
+
+    def __init__(self, filename: str, max_bytes: int = MAX_BYTES, backup_count: int = BACKUP_COUNT):
+        super().__init__(filename, encoding="utf-8", maxBytes=max_bytes, backupCount=backup_count)
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            self.stream.write(self.format(record) + self.terminator)
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def rotation_filename(self, default_name: str) -> str:
+        return f"{default_name}.gz"
+
+    def rotate(self, source: str, dest: str):
+        with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """Merges the message with its arguments, which could change before the
+    record is written, but unlike QueueHandler leaves the exception to the
+    listener's formatter."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class BatchingListener(logging.handlers.QueueListener):
+    """Writes the records of a QueueHandler on its own thread, flushing the
+    handlers once the queue is drained or every BATCH_SIZE records."""
+
+    def __init__(self, queue: queue.Queue, *handlers: logging.Handler):
+        super().__init__(queue, *handlers, respect_handler_level=True)
+        self.pending = 0
+
+    def handle(self, record: logging.LogRecord):
+        super().handle(record)
+        self.pending += 1
+        if self.pending >= BATCH_SIZE or self.queue.empty():
+            self.flush()
+
+    def flush(self):
+        self.pending = 0
+        for handler in self.handlers:
+            handler.flush()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        super().stop()
+        for handler in self.handlers:
+            handler.close()
+
+
+def setup(logger: logging.Logger, filename: str, format: str = "text", max_bytes: int = MAX_BYTES, backup_count: int = BACKUP_COUNT) -> BatchingListener:
+    """Routes the logger's records through a queue to a file written on a
+    background thread, so logging never blocks on disk I/O. Returns the
+    started listener, stop it to write out what is left."""
+    handler = CompressingFileHandler(filename, max_bytes, backup_count)
+    if format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(
+            logging.Formatter("[{asctime}] [{levelname:<8}] {name}: {message}", DATE_FORMAT, style="{")
+        )
+    records: queue.Queue = queue.Queue()
+    logger.addHandler(RecordQueueHandler(records))
+    listener = BatchingListener(records, handler)
+    listener.start()
+    return listener
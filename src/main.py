@@ -1,8 +1,15 @@
+from startup import STARTUP
 from threading import Thread
-import bot
-import websocket.app
 
-Thread(target=websocket.app.start, daemon=True).start()
+with STARTUP.phase("imports"):
+    import bot
+    import config
+
+# The aiohttp server is started by the bot itself, on its own loop
+if config.CONFIG.stream_server == "flask":
+    import websocket.app
+
+    Thread(target=websocket.app.start, daemon=True).start()
 
 try:
     bot.run()
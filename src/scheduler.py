@@ -0,0 +1,87 @@
+import asyncio
+from typing import List, Optional
+
+
+class CaptureSchedule:
+    """Fixed-rate capture deadlines on the event loop's monotonic clock.
+
+    Capture i is due at start + i * interval. Deadlines are absolute, so time
+    spent capturing and saving never accumulates into drift, and the task
+    only wakes when a capture is actually due.
+    """
+
+    def __init__(self, interval: float, count: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.interval = interval
+        self.count = count
+        self.loop = loop or asyncio.get_running_loop()
+        self.start = self.loop.time()
+        self.completed = 0
+        self.jitter: List[float] = []
+        self.cancelled = False
+        # Sequence number of the last frame captured for this schedule, see
+        # capture.CaptureArbiter
+        self.last_seq = 0
+        self._waiter: Optional[asyncio.Future] = None
+
+    def begin(self):
+        """Restarts the clock, capture 0 becomes due now."""
+        self.start = self.loop.time()
+
+    def deadline(self, i: int) -> float:
+        return self.start + i * self.interval
+
+    async def wait(self, i: int) -> bool:
+        """Sleeps until capture i is due. Returns False if canceled meanwhile."""
+        if self.cancelled:
+            return False
+        self._waiter = self.loop.create_future()
+        handle = self.loop.call_at(self.deadline(i), self._wake)
+        try:
+            await self._waiter
+        finally:
+            handle.cancel()
+            self._waiter = None
+        return not self.cancelled
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def cancel(self):
+        self.cancelled = True
+        self._wake()
+
+    def captured(self, i: int, at: Optional[float] = None):
+        """Records that capture i happened, at loop time `at` (now by default)."""
+        at = self.loop.time() if at is None else at
+        self.jitter.append(at - self.deadline(i))
+        self.completed = i + 1
+
+    def elapsed(self) -> float:
+        return self.loop.time() - self.start
+
+    @property
+    def progress(self) -> float:
+        return self.completed / self.count if self.count else 1.0
+
+    @property
+    def eta(self) -> float:
+        """Seconds until the last capture is due."""
+        return max(0.0, self.deadline(self.count - 1) - self.loop.time())
+
+    @property
+    def mean_jitter(self) -> float:
+        return sum(self.jitter) / len(self.jitter) if self.jitter else 0.0
+
+    @property
+    def max_jitter(self) -> float:
+        return max(self.jitter, default=0.0)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for i in range(self.completed, self.count):
+            if not await self.wait(i):
+                return
+            yield i
@@ -0,0 +1,59 @@
+import asyncio
+import contextlib
+import time
+from typing import Callable, Dict, Final
+
+# Close enough to process start, main imports this first
+T0: Final[float] = time.perf_counter()
+
+
+class Startup:
+    """Times startup phases and runs slow initialization in the background
+    while the gateway connects."""
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        # Background phases that raised, by name
+        self.failures: Dict[str, Exception] = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - t
+
+    def mark(self, name: str):
+        """Records the time since process start."""
+        self.timings[name] = time.perf_counter() - T0
+
+    def background(self, name: str, fn: Callable):
+        """Runs blocking fn in a thread, timed as phase `name`."""
+
+        async def run():
+            with self.phase(name):
+                try:
+                    return await asyncio.to_thread(fn)
+                except Exception as e:
+                    self.failures[name] = e
+                    raise
+
+        self.tasks[name] = asyncio.get_running_loop().create_task(run())
+
+    async def wait(self, name: str):
+        return await self.tasks[name]
+
+    async def wait_all(self):
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+    def report(self) -> str:
+        return ", ".join(
+            f"{name}: {seconds * 1000:.0f} ms"
+            + (f" (failed: {self.failures[name]!r})" if name in self.failures else "")
+            for name, seconds in self.timings.items()
+        )
+
+
+STARTUP: Final[Startup] = Startup()
@@ -0,0 +1,515 @@
+import asyncio
+import http.client
+import json
+import logging
+import os
+import random
+import socket
+import ssl
+import threading
+import urllib.parse
+import uuid
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from dataclasses_json import dataclass_json
+import config
+
+QUEUE_FILE = "data/uploads.jsonl"
+# Log lines before the queue file gets compacted, as long as most of them are
+# about finished jobs
+COMPACT_MIN = 1000
+SERVICE_ACCOUNT_FILE = "google_service.json"
+SCOPES = ["https://www.googleapis.com/auth/drive"]
+FOLDER_MIMETYPE = "application/vnd.google-apps.folder"
+MANIFEST_FILE = "remote.jsonl"
+# Seconds, doubled on every failed attempt of a job up to MAX_BACKOFF
+BACKOFF = 2.0
+MAX_BACKOFF = 300.0
+MAX_ATTEMPTS = 10
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+# Connection trouble. Other OSErrors, e.g. the file having been deleted, won't
+# go away by retrying.
+NETWORK_ERRORS = (
+    ConnectionError, TimeoutError, socket.timeout, socket.gaierror, ssl.SSLError,
+    http.client.HTTPException,
+)
+
+logger = logging.getLogger("discord.uploads")
+
+_service = None
+_credentials = None
+_service_lock = threading.Lock()
+_local = threading.local()
+
+
+def drive_service():
+    """The Drive client, built once. Rebuilding it re-reads the service
+    account and the discovery document on every upload."""
+    global _service, _credentials
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                from googleapiclient.discovery import build
+
+                endpoint = config.CONFIG.drive_api_endpoint
+                if endpoint:
+                    from google.auth.credentials import AnonymousCredentials
+
+                    _credentials = AnonymousCredentials()
+                else:
+                    from google.oauth2 import service_account
+
+                    _credentials = service_account.Credentials.from_service_account_file(
+                        SERVICE_ACCOUNT_FILE, scopes=SCOPES
+                    )
+                _service = build(
+                    "drive",
+                    "v3",
+                    credentials=_credentials,
+                    client_options={"api_endpoint": endpoint} if endpoint else None,
+                    cache_discovery=False,
+                )
+    return _service
+
+
+def _http():
+    """Authorized http of the calling thread, httplib2 is not thread safe.
+    Tokens are shared through the credentials."""
+    http = getattr(_local, "http", None)
+    if http is None:
+        import google_auth_httplib2
+        from googleapiclient.http import build_http
+
+        drive_service()
+        # build_http stops httplib2 from following the 308s of resumable uploads
+        _local.http = http = google_auth_httplib2.AuthorizedHttp(_credentials, http=build_http())
+    return http
+
+
+@dataclass_json
+@dataclass
+class UploadJob:
+    id: str
+    path: str
+    name: str
+    folder_id: str
+    # Remove the local file once uploaded
+    delete_after: bool = False
+    # Resumable session of the upload in progress, survives restarts
+    session_uri: Optional[str] = None
+    progress: int = 0
+    attempts: int = 0
+    # Remote manifest to record the upload in, and the file's path in it
+    manifest: Optional[str] = None
+    key: Optional[str] = None
+
+
+def create_folder(name: str, parent_id: str) -> str:
+    """Blocking, returns the new folder's ID."""
+    request = drive_service().files().create(
+        body={"name": name, "mimeType": FOLDER_MIMETYPE, "parents": [parent_id]},
+        fields="id",
+    )
+    return request.execute(http=_http(), num_retries=MAX_ATTEMPTS)["id"]
+
+
+def _is_retryable(e: Exception) -> bool:
+    from googleapiclient.errors import HttpError
+    import httplib2
+
+    if isinstance(e, HttpError):
+        if e.status_code in RETRY_STATUSES:
+            return True
+        return e.status_code == 403 and any(
+            detail.get("reason") in RATE_LIMIT_REASONS
+            for detail in (e.error_details if isinstance(e.error_details, list) else [])
+        )
+    return isinstance(e, NETWORK_ERRORS + (httplib2.HttpLib2Error,))
+
+
+class UploadStopped(Exception):
+    """The queue was stopped between two chunks of an upload."""
+
+
+def _is_expired_session(e: Exception) -> bool:
+    from googleapiclient.errors import HttpError
+
+    return isinstance(e, HttpError) and e.status_code in (404, 410)
+
+
+class UploadQueue:
+    """Uploads files to Drive in the background.
+
+    Jobs are saved to `path` until they finish, along with the resumable
+    session URI once the upload has started, so a restart picks up where it
+    left off instead of starting over. Failed attempts are retried with
+    exponential backoff.
+
+    The file is a log, every change to a job appends its state and finishing
+    appends its ID, so saving costs the same however long the queue is. It
+    is rewritten with the unfinished jobs only once mostly stale.
+    """
+
+    def __init__(self, path: str = QUEUE_FILE, concurrency: Optional[int] = None, chunk_size: Optional[int] = None):
+        self.path = path
+        self.concurrency = concurrency or config.CONFIG.upload_concurrency
+        self.chunk_size = chunk_size or config.CONFIG.upload_chunk_size
+        self.jobs: Dict[str, UploadJob] = {}
+        self.waiters: Dict[str, asyncio.Future] = {}
+        self.pending: Optional[asyncio.Queue] = None
+        self.workers: List[asyncio.Task] = []
+        # Jobs are saved from worker threads too
+        self.lock = threading.Lock()
+        # Checked by uploads between chunks, a thread can't be cancelled
+        self.stopping = threading.Event()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as fs:
+                for line in fs:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn last line of a crash
+                        continue
+                    if "done" in record:
+                        self.jobs.pop(record["done"], None)
+                    else:
+                        job = UploadJob.from_dict(record["job"])
+                        self.jobs[job.id] = job
+        self.fs = None
+        self.records = 0
+        self.compact()
+
+    def _append(self, record: Dict):
+        with self.lock:
+            self.fs.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self.fs.flush()
+            self.records += 1
+
+    def save(self, job: UploadJob):
+        """Saves the current state of a job."""
+        self._append(dict(job=job.to_dict()))
+
+    def compact(self):
+        """Rewrites the file with only the unfinished jobs. Called from the
+        loop, which is the only place jobs are added or removed."""
+        lines = [
+            json.dumps(dict(job=job.to_dict()), separators=(",", ":")) + "\n"
+            for job in self.jobs.values()
+        ]
+        with self.lock:
+            if self.fs is not None:
+                self.fs.close()
+            with open(f"{self.path}.tmp", "wt", encoding="utf-8") as fs:
+                fs.writelines(lines)
+            os.replace(f"{self.path}.tmp", self.path)
+            self.fs = open(self.path, "at", encoding="utf-8")
+            self.records = len(lines)
+
+    def start(self):
+        """Starts the workers on the running loop, resuming saved jobs."""
+        self.stopping.clear()
+        self.pending = asyncio.Queue()
+        for job in self.jobs.values():
+            self.pending.put_nowait(job)
+        self.workers = [
+            asyncio.get_running_loop().create_task(self.worker())
+            for _ in range(self.concurrency)
+        ]
+
+    async def stop(self):
+        """Stops the workers. Unfinished jobs stay saved for the next start,
+        uploads in progress stop after their current chunk."""
+        self.stopping.set()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def put(self, path: str, name: str, folder_id: str, delete_after: bool = False, manifest: Optional[str] = None, key: Optional[str] = None) -> asyncio.Future:
+        """Queues a file, returns a future for the uploaded file's Drive ID.
+
+        If `manifest` is given, the upload is recorded in it as `key` once
+        done, even if that is after a restart.
+        """
+        job = UploadJob(
+            uuid.uuid4().hex, os.path.abspath(path), name, folder_id, delete_after,
+            manifest=manifest, key=key,
+        )
+        self.jobs[job.id] = job
+        self.save(job)
+        self.waiters[job.id] = future = asyncio.get_running_loop().create_future()
+        self.pending.put_nowait(job)
+        return future
+
+    def cancel(self, manifest: str) -> int:
+        """Drops the queued jobs of a manifest, returns how many."""
+        cancelled = [job for job in self.jobs.values() if job.manifest == manifest]
+        for job in cancelled:
+            future = self.waiters.get(job.id)
+            if future is not None:
+                future.cancel()
+            self.finish(job)
+        return len(cancelled)
+
+    def __len__(self):
+        return len(self.jobs)
+
+    async def worker(self):
+        while True:
+            job = await self.pending.get()
+            if job.id not in self.jobs:
+                # Cancelled while queued
+                continue
+            try:
+                file_id = await self.run(job)
+            except UploadStopped:
+                # Stays saved with its session for the next start
+                return
+            except Exception as e:
+                logger.error(f"Upload of '{job.name}' failed after {job.attempts} attempts: {e!r}")
+                self.finish(job, exception=e)
+            else:
+                logger.info(f"Uploaded '{job.name}' ({file_id})")
+                if job.manifest and job.id in self.jobs:
+                    RemoteManifest.append(job.manifest, dict(path=job.key, id=file_id))
+                if job.delete_after and os.path.exists(job.path):
+                    os.remove(job.path)
+                self.finish(job, result=file_id)
+
+    async def run(self, job: UploadJob) -> str:
+        while True:
+            progress = job.progress
+            try:
+                return await asyncio.to_thread(self.upload, job)
+            except UploadStopped:
+                raise
+            except Exception as e:
+                # Only consecutive attempts without progress count
+                job.attempts = job.attempts + 1 if job.progress == progress else 1
+                if _is_expired_session(e) and job.session_uri:
+                    # Sessions last about a week, start a new one
+                    job.session_uri = None
+                    job.progress = 0
+                elif not _is_retryable(e) or job.attempts >= MAX_ATTEMPTS:
+                    raise
+                self.save(job)
+                delay = min(MAX_BACKOFF, BACKOFF * 2 ** (job.attempts - 1))
+                logger.warning(f"Upload of '{job.name}' failed, retrying in {delay:.0f} s: {e!r}")
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+    def upload(self, job: UploadJob) -> str:
+        """Blocking, uploads from the last saved position."""
+        from googleapiclient.http import MediaFileUpload
+
+        media = MediaFileUpload(job.path, chunksize=self.chunk_size, resumable=True)
+        request = drive_service().files().create(
+            media_body=media,
+            body={"name": job.name, "parents": [job.folder_id]},
+            fields="id",
+        )
+        endpoint = config.CONFIG.drive_api_endpoint
+        if endpoint:
+            # Media uploads keep the https scheme when the endpoint is
+            # overridden, a local fake server is plain http
+            request.uri = urllib.parse.urlparse(request.uri)._replace(
+                scheme=urllib.parse.urlparse(endpoint).scheme
+            ).geturl()
+        http = _http()
+        if job.session_uri:
+            file_id = self.resume(request, job, http)
+            if file_id is not None:
+                return file_id
+        response = None
+        try:
+            while response is None:
+                if self.stopping.is_set():
+                    raise UploadStopped(job.name)
+                status, response = request.next_chunk(http=http)
+                if status and status.resumable_progress != job.progress:
+                    job.progress = status.resumable_progress
+                    job.session_uri = request.resumable_uri
+                    self.save(job)
+        finally:
+            # Also when the first chunk failed, the session is kept either way
+            if request.resumable_uri != job.session_uri:
+                job.session_uri = request.resumable_uri
+                self.save(job)
+        return response["id"]
+
+    def resume(self, request, job: UploadJob, http) -> Optional[str]:
+        """Blocking, points the request at the job's saved session and at what
+        the server already has of it, per an empty PUT. Returns the file's ID
+        if the upload turns out to be complete."""
+        from googleapiclient.errors import HttpError
+
+        size = os.path.getsize(job.path)
+        response, content = http.request(
+            job.session_uri, "PUT", body=b"",
+            headers={"Content-Length": "0", "Content-Range": f"bytes */{size}"},
+        )
+        if response.status in (200, 201):
+            return json.loads(content)["id"]
+        if response.status != 308:
+            raise HttpError(response, content, uri=job.session_uri)
+        # Inclusive, and missing if nothing was received
+        received = response.get("range")
+        request.resumable_uri = job.session_uri
+        request.resumable_progress = int(received.rsplit("-", 1)[1]) + 1 if received else 0
+        job.progress = request.resumable_progress
+        return None
+
+    def finish(self, job: UploadJob, result: Optional[str] = None, exception: Optional[Exception] = None):
+        if self.jobs.pop(job.id, None) is not None:
+            self._append(dict(done=job.id))
+        if self.records > COMPACT_MIN and self.records > 4 * len(self.jobs):
+            self.compact()
+        future = self.waiters.pop(job.id, None)
+        if future is not None and not future.done():
+            if exception is not None:
+                future.set_exception(exception)
+                # Nobody may be waiting, it is logged already
+                future.exception()
+            else:
+                future.set_result(result)
+
+
+class RemoteManifest:
+    """What of a directory is already on Drive.
+
+    Append-only like the timelapse journal, one JSON line per folder created
+    or file uploaded, with paths relative to the directory.
+    """
+
+    def __init__(self, dir: str):
+        self.path = os.path.join(dir, MANIFEST_FILE)
+        self.folders: Dict[str, str] = {}
+        self.files: Dict[str, str] = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as fs:
+                for line in fs:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn last line of a crash
+                        continue
+                    if "folder" in record:
+                        self.folders[record["folder"]] = record["id"]
+                    else:
+                        self.files[record["path"]] = record["id"]
+
+    @staticmethod
+    def append(path: str, record: Dict[str, str]):
+        if not os.path.isdir(os.path.dirname(path) or "."):
+            # The directory was deleted while its upload ran
+            return
+        with open(path, "at", encoding="utf-8") as fs:
+            fs.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def add_folder(self, folder: str, id: str):
+        self.folders[folder] = id
+        self.append(self.path, dict(folder=folder, id=id))
+
+
+class TimelapseSync:
+    """Mirrors a timelapse directory into its own Drive folder while it is
+    being captured.
+
+    Frames are queued for upload as they are saved, so only what was written
+    at the end, the video and metadata, is left to push when it finishes.
+    """
+
+    def __init__(self, queue: UploadQueue, dir: str, name: str, parent_id: str):
+        self.queue = queue
+        self.dir = dir
+        self.name = name
+        self.parent_id = parent_id
+        self.manifest = RemoteManifest(dir)
+        # Uploads queued this run, by path relative to dir
+        self.queued: Dict[str, asyncio.Future] = {}
+        self.preparing: List[asyncio.Task] = []
+
+    @property
+    def folder_id(self) -> Optional[str]:
+        return self.manifest.folders.get("")
+
+    @property
+    def url(self) -> str:
+        return f"https://drive.google.com/drive/folders/{self.folder_id}?usp=sharing"
+
+    def relative(self, path: str) -> str:
+        relative = os.path.relpath(path, self.dir)
+        return "" if relative == "." else relative.replace(os.sep, "/")
+
+    def folder(self, relative: str) -> str:
+        """Blocking, the Drive folder for a relative directory, created on
+        first use."""
+        if relative not in self.manifest.folders:
+            if relative == "":
+                id = create_folder(self.name, self.parent_id)
+            else:
+                head, tail = os.path.split(relative)
+                id = create_folder(tail, self.folder(head))
+            self.manifest.add_folder(relative, id)
+        return self.manifest.folders[relative]
+
+    def prepare(self, relative: str):
+        """Creates the Drive folder for a relative directory in the
+        background."""
+        task = asyncio.get_running_loop().create_task(asyncio.to_thread(self.folder, relative))
+        task.add_done_callback(self._prepared)
+        self.preparing.append(task)
+
+    def _prepared(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(
+                f"Could not create the Drive folder of '{self.name}' yet, "
+                f"its files are queued when it finishes: {task.exception()!r}"
+            )
+
+    async def prepared(self):
+        """Waits for the folders being created in the background, so walk()
+        does not create them twice."""
+        await asyncio.gather(*self.preparing, return_exceptions=True)
+        self.preparing = []
+
+    def add(self, path: str):
+        """Queues a file under the directory unless it is already on Drive.
+
+        Files whose Drive folder does not exist yet, see prepare(), are left
+        for walk() to find. Runs on the event loop.
+        """
+        key = self.relative(path)
+        if self.uploaded_or_queued(key) or os.path.dirname(key) not in self.manifest.folders:
+            return
+        self.queued[key] = self.queue.put(
+            path,
+            os.path.basename(path),
+            self.manifest.folders[os.path.dirname(key)],
+            manifest=self.manifest.path,
+            key=key,
+        )
+
+    def uploaded_or_queued(self, key: str) -> bool:
+        if key in self.manifest.files:
+            return True
+        future = self.queued.get(key)
+        if future is None:
+            return False
+        return not future.done() or (not future.cancelled() and future.exception() is None)
+
+    def walk(self) -> List[str]:
+        """Blocking, every file under the directory. Creates the Drive
+        folders they go in."""
+        paths = []
+        for root, _, files in os.walk(self.dir):
+            self.folder(self.relative(root))
+            paths.extend(
+                os.path.join(root, file) for file in sorted(files)
+                if file != MANIFEST_FILE
+            )
+        return paths
+
+    def cancel(self):
+        self.queue.cancel(self.manifest.path)
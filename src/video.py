@@ -0,0 +1,301 @@
+import asyncio
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+from typing import Callable, List, Optional, Tuple
+import ffmpeg
+import numpy as np
+
+FRAMERATE = 30
+CRF = 17
+# Frames. Shorter segments are not worth an ffmpeg process of their own.
+MIN_SEGMENT = 2 * FRAMERATE
+# Share of the size limit a preview aims for, the rest covers container
+# overhead and rate control error
+PREVIEW_HEADROOM = 0.92
+PREVIEW_MIN_BPP = 0.05
+
+
+class LiveEncoder:
+    """Long running ffmpeg process fed raw frames over stdin.
+
+    The output is fragmented MP4, so whatever was written before a crash is
+    still a playable video.
+    """
+
+    def __init__(self, path: str, framerate: int = FRAMERATE, crf: int = CRF):
+        self.path = path
+        self.framerate = framerate
+        self.crf = crf
+        self.size = None
+        self.frames = 0
+        self.process: Optional[subprocess.Popen] = None
+        # A file rather than a pipe, nobody drains it while frames go in
+        self.log = tempfile.TemporaryFile()
+
+    def _start(self, size):
+        self.size = size
+        args = (
+            ffmpeg
+            .input(
+                "pipe:",
+                format="rawvideo",
+                pix_fmt="rgb24",
+                s=f"{size[0]}x{size[1]}",
+                framerate=self.framerate,
+            )
+            .output(
+                self.path,
+                vcodec="libx264",
+                crf=self.crf,
+                pix_fmt="yuv420p",
+                # Keyframe every second of video, each one closes a fragment
+                g=self.framerate,
+                movflags="frag_keyframe+empty_moov+default_base_moof",
+            )
+            .global_args("-loglevel", "error", "-nostats")
+            .overwrite_output()
+            .compile()
+        )
+        self.process = subprocess.Popen(
+            args, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self.log
+        )
+
+    def write(self, rgb: np.ndarray):
+        """Writes one HxWx3 uint8 frame."""
+        size = (rgb.shape[1], rgb.shape[0])
+        if self.process is None:
+            self._start(size)
+        if size != self.size:
+            raise ValueError(f"Frame size changed from {self.size} to {size}")
+        self.process.stdin.write(np.ascontiguousarray(rgb).data)
+        self.frames += 1
+
+    def close(self):
+        """Flushes the remaining frames and waits for ffmpeg to finish."""
+        try:
+            if self.process is None:
+                return
+            self.process.stdin.close()
+            self.process.wait()
+            if self.process.returncode:
+                self.log.seek(0)
+                raise ffmpeg.Error("ffmpeg", None, self.log.read())
+        finally:
+            self.log.close()
+
+    def abort(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+
+
+def encode_frames(frames_dir: str, path: str, framerate: int = FRAMERATE, crf: int = CRF):
+    """Encodes frames_dir/%d.png into an mp4 at path."""
+    (
+        ffmpeg
+        .input(f"{frames_dir}/%d.png")
+        .output(
+            path,
+            framerate=framerate,
+            vcodec="libx264",
+            crf=crf,
+            pix_fmt="yuv420p"
+        )
+        .overwrite_output()
+        .run(capture_stdout=True, capture_stderr=True)
+    )
+
+
+def count_frames(frames_dir: str) -> int:
+    """Number of frames numbered 0.png, 1.png, ... without gaps."""
+    names = set(os.listdir(frames_dir))
+    count = 0
+    while f"{count}.png" in names:
+        count += 1
+    return count
+
+
+class SegmentedEncode:
+    """Encodes frames_dir/%d.png into an mp4 at path using every core.
+
+    The frames are split into contiguous segments, each encoded by its own
+    ffmpeg process, and the segments are joined without re-encoding. Runs
+    entirely in subprocesses, so awaiting it does not block the event loop.
+    """
+
+    def __init__(self, frames_dir: str, path: str, framerate: int = FRAMERATE, crf: int = CRF, jobs: Optional[int] = None):
+        self.frames_dir = frames_dir
+        self.path = path
+        self.framerate = framerate
+        self.crf = crf
+        self.jobs = jobs or os.cpu_count() or 1
+        self.count = 0
+        # Frames done so far, per segment
+        self.encoded: List[int] = []
+        self.cancelled = False
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def progress(self) -> float:
+        return sum(self.encoded) / self.count if self.count else 0.0
+
+    def segments(self) -> List[Tuple[int, int]]:
+        """(start, length) of every segment."""
+        n = max(1, min(self.jobs, self.count // MIN_SEGMENT))
+        length = math.ceil(self.count / n)
+        return [
+            (start, min(length, self.count - start))
+            for start in range(0, self.count, length)
+        ]
+
+    async def run(self):
+        """Raises asyncio.CancelledError if cancel() was called."""
+        self.task = asyncio.ensure_future(self._run())
+        await self.task
+
+    def cancel(self):
+        self.cancelled = True
+        if self.task is not None:
+            self.task.cancel()
+
+    async def _run(self):
+        self.count = await asyncio.to_thread(count_frames, self.frames_dir)
+        if not self.count:
+            raise ValueError(f"No frames in {self.frames_dir}")
+        segments = self.segments()
+        self.encoded = [0] * len(segments)
+        # Next to the output, so the concat does not cross filesystems
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            paths = [os.path.join(tmp, f"{i}.mp4") for i in range(len(segments))]
+            # Each process gets a fair share of the cores, x264 scales
+            # worse with threads than with processes
+            threads = max(1, (os.cpu_count() or 1) // len(segments))
+            tasks = [
+                asyncio.ensure_future(self._encode_segment(i, start, length, paths[i], threads))
+                for i, (start, length) in enumerate(segments)
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # A failed or cancelled segment stops the others too
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            await self._concat(paths, os.path.join(tmp, "segments.txt"))
+        finally:
+            await asyncio.to_thread(shutil.rmtree, tmp, True)
+
+    async def _encode_segment(self, i: int, start: int, length: int, path: str, threads: int):
+        def on_progress(frames: int):
+            self.encoded[i] = frames
+
+        await run_ffmpeg(
+            ffmpeg
+            .input(f"{self.frames_dir}/%d.png", framerate=self.framerate, start_number=start)
+            .output(
+                path,
+                vframes=length,
+                vcodec="libx264",
+                crf=self.crf,
+                pix_fmt="yuv420p",
+                threads=threads,
+            ),
+            on_progress,
+        )
+        self.encoded[i] = length
+
+    async def _concat(self, paths: List[str], list_path: str):
+        with open(list_path, "wt", encoding="utf-8") as fs:
+            for path in paths:
+                fs.write(concat_entry(path, os.path.dirname(list_path)))
+        await run_ffmpeg(
+            ffmpeg
+            .input(list_path, format="concat", safe=0)
+            .output(self.path, c="copy", movflags="+faststart")
+        )
+
+
+def concat_entry(path: str, start: str) -> str:
+    """Line of an ffmpeg concat list. Relative to the list's directory, and
+    quoted with ' escaped, as the timelapse name can contain one."""
+    relative = os.path.relpath(path, start).replace("'", "'\\''")
+    return f"file '{relative}'\n"
+
+
+async def run_ffmpeg(stream, on_progress: Optional[Callable[[int], None]] = None):
+    """Runs an ffmpeg-python output stream as an asyncio subprocess.
+
+    on_progress gets the number of frames done as ffmpeg reports it. Raises
+    ffmpeg.Error on failure, and kills ffmpeg if cancelled.
+    """
+    args = (
+        stream
+        .global_args("-loglevel", "error", "-nostats", "-progress", "pipe:1")
+        .overwrite_output()
+        .compile()
+    )
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    async def progress():
+        async for line in process.stdout:
+            if on_progress and line.startswith(b"frame="):
+                on_progress(int(line[len(b"frame="):]))
+
+    try:
+        # Both pipes are drained at once, ffmpeg blocks on a full one
+        _, stderr = await asyncio.gather(progress(), process.stderr.read())
+        if await process.wait():
+            raise ffmpeg.Error("ffmpeg", None, stderr)
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+
+def preview_plan(size: Tuple[int, int], frames: int, limit: int, framerate: int = FRAMERATE) -> Tuple[int, Tuple[int, int]]:
+    """Video bitrate and frame size of a preview that fits in `limit` bytes.
+
+    The bitrate is whatever the duration leaves per second. The frame size
+    is the largest that still gets PREVIEW_MIN_BPP bits per pixel at that
+    bitrate, below which x264 smears detail more than downscaling does.
+    """
+    duration = max(frames, 1) / framerate
+    bitrate = int(limit * 8 * PREVIEW_HEADROOM / duration)
+    pixels = bitrate / (framerate * PREVIEW_MIN_BPP)
+    scale = min(1.0, math.sqrt(pixels / (size[0] * size[1])))
+    # x264 wants even dimensions
+    width = max(2, int(size[0] * scale) // 2 * 2)
+    height = max(2, int(size[1] * scale) // 2 * 2)
+    return bitrate, (width, height)
+
+
+async def encode_preview(source: str, path: str, size: Tuple[int, int], frames: int, limit: int, framerate: int = FRAMERATE) -> bool:
+    """Two-pass encodes a smaller copy of the video at source that fits in
+    `limit` bytes, sized by preview_plan.
+
+    The first pass only analyses the video, so the bitrate is spent where
+    it is needed and the size lands close to the target without trial
+    encodes. Returns whether the result fits.
+    """
+    bitrate, (width, height) = preview_plan(size, frames, limit, framerate)
+    with tempfile.TemporaryDirectory() as tmp:
+        options = dict(
+            vcodec="libx264",
+            pix_fmt="yuv420p",
+            preset="medium",
+            passlogfile=os.path.join(tmp, "pass"),
+            # Short videos would otherwise fit their whole budget, and more,
+            # in the rate control buffer
+            **{"b:v": bitrate, "maxrate": int(bitrate * 1.5), "bufsize": min(bitrate * 2, int(limit * 8 * PREVIEW_HEADROOM / 2))},
+        )
+        stream = ffmpeg.input(source).video.filter("scale", width, height)
+        await run_ffmpeg(stream.output(os.devnull, format="null", **{"pass": 1}, **options))
+        await run_ffmpeg(stream.output(path, movflags="+faststart", **{"pass": 2}, **options))
+    return os.stat(path).st_size <= limit
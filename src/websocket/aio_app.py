@@ -0,0 +1,146 @@
+import sys
+import os
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import asyncio
+from aiohttp import web
+import socketio
+import constants
+import cameras
+from websocket.streaming import StreamingOutput, StreamVariant
+
+TEMPLATES_DIR = os.path.join(current, "templates")
+STATIC_DIR = os.path.join(current, "static")
+IDLE_CHECK_INTERVAL = 5.0
+
+sio = socketio.AsyncServer(async_mode="aiohttp")
+stream_output = StreamingOutput()
+clients = 0
+
+
+class FrameNotifier:
+    """Wakes every stream handler on the loop once per published frame.
+
+    The camera thread schedules a single callback per frame, no matter how
+    many viewers are connected.
+    """
+
+    def __init__(self, output: StreamingOutput, loop: asyncio.AbstractEventLoop):
+        self.output = output
+        self.loop = loop
+        self.event = asyncio.Event()
+        output.add_listener(self.on_frame)
+
+    def on_frame(self, seq: int):
+        self.loop.call_soon_threadsafe(self.notify)
+
+    def notify(self):
+        event, self.event = self.event, asyncio.Event()
+        event.set()
+
+    async def wait(self):
+        await self.event.wait()
+
+    def close(self):
+        self.output.remove_listener(self.on_frame)
+
+
+@sio.event
+async def connect(sid, environ):
+    global clients
+    clients += 1
+    if clients == 1:
+        # Resolved off the loop, the camera may still be setting up
+        camera = await asyncio.to_thread(cameras.get_camera)
+        await asyncio.to_thread(camera.start_stream, stream_output)
+    await sio.emit("updateClients", clients)
+
+
+@sio.event
+async def disconnect(sid):
+    global clients
+    clients -= 1
+    if clients == 0:
+        # Resolved off the loop, the camera may still be setting up
+        camera = await asyncio.to_thread(cameras.get_camera)
+        await asyncio.to_thread(camera.stop_stream)
+    await sio.emit("updateClients", clients)
+
+
+async def index(request: web.Request):
+    return web.FileResponse(os.path.join(TEMPLATES_DIR, "index.html"))
+
+
+async def stream(request: web.Request):
+    notifier: FrameNotifier = request.app["notifier"]
+    try:
+        variant = StreamVariant.from_query(
+            request.query.get("scale"), request.query.get("quality")
+        )
+    except (ValueError, ZeroDivisionError):
+        raise web.HTTPBadRequest() from None
+    response = web.StreamResponse(
+        headers={"Content-Type": "multipart/x-mixed-replace; boundary=frame"}
+    )
+    await response.prepare(request)
+    with stream_output.subscribe(variant) as reader:
+        try:
+            while True:
+                seq = reader.poll()
+                if seq is None:
+                    try:
+                        await asyncio.wait_for(notifier.wait(), IDLE_CHECK_INTERVAL)
+                    except asyncio.TimeoutError:
+                        # No frames to write, so a closed viewer would go
+                        # unnoticed otherwise
+                        if request.transport is None or request.transport.is_closing():
+                            break
+                    continue
+                if reader.is_rendered(seq):
+                    frame = reader.render(seq)
+                else:
+                    frame = await asyncio.to_thread(reader.render, seq)
+                # Only awaits the socket drain, a slow viewer just falls
+                # behind on the ring.
+                await response.write(reader.part(seq, frame))
+        except ConnectionResetError:
+            pass
+    return response
+
+
+async def stats(request: web.Request):
+    return web.json_response(stream_output.stats)
+
+
+def create_app() -> web.Application:
+    app = web.Application()
+    sio.attach(app)
+    app.router.add_get("/", index)
+    app.router.add_get("/stream.mjpg", stream)
+    app.router.add_get("/stats", stats)
+    app.router.add_static("/static", STATIC_DIR)
+
+    async def on_startup(app: web.Application):
+        app["notifier"] = FrameNotifier(stream_output, asyncio.get_running_loop())
+
+    async def on_cleanup(app: web.Application):
+        app["notifier"].close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+async def start(host="0.0.0.0", port=constants.PORT) -> web.AppRunner:
+    """Starts serving on the running loop, e.g. the bot's."""
+    runner = web.AppRunner(create_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), port=constants.PORT)
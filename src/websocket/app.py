@@ -5,12 +5,11 @@ current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
 sys.path.append(parent)
 
-import io
-from threading import Condition
-from flask import Flask, Response, render_template
+from flask import Flask, Response, abort, jsonify, render_template, request
 from flask_socketio import SocketIO, emit
 import constants
 import cameras
+from websocket.streaming import StreamingOutput, StreamVariant
 
 # Set this variable to "threading", "eventlet" or "gevent" to test the
 # different async modes, or leave it set to None for the application to choose
@@ -20,16 +19,6 @@ app = Flask(__name__)
 socketio = SocketIO(app)
 clients = 0
 
-class StreamingOutput(io.BufferedIOBase):
-    def __init__(self):
-        self.frame = None
-        self.condition = Condition()
-
-    def write(self, buf):
-        with self.condition:
-            self.frame = buf
-            self.condition.notify_all()
-
 stream_output = StreamingOutput()
 
 @socketio.on("connect")
@@ -52,15 +41,25 @@ def disconnect():
 def index():
     return render_template("index.html", sync_mode=socketio.async_mode)
 
-def gen_frames():
-    while True:
-        with stream_output.condition:
-            stream_output.condition.wait()
-            yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + stream_output.frame + b'\r\n')
+def gen_frames(variant: StreamVariant):
+    with stream_output.subscribe(variant) as reader:
+        while True:
+            frame = reader.next_frame()
+            yield reader.part(reader.seq, frame)
 
 @app.route("/stream.mjpg")
 def stream():
-    return Response(gen_frames(), mimetype="multipart/x-mixed-replace; boundary=frame")
+    try:
+        variant = StreamVariant.from_query(
+            request.args.get("scale"), request.args.get("quality")
+        )
+    except (ValueError, ZeroDivisionError):
+        abort(400)
+    return Response(gen_frames(variant), mimetype="multipart/x-mixed-replace; boundary=frame")
+
+@app.route("/stats")
+def stats():
+    return jsonify(stream_output.stats)
 
 def start(debug=False, use_reloader=False):
     socketio.run(
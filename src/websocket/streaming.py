@@ -0,0 +1,270 @@
+import io
+import threading
+import time
+from fractions import Fraction
+from typing import Callable, Dict, List, Optional, Tuple
+import simplejpeg
+
+# Frames kept around after publishing. Readers only ever need the newest one,
+# the rest is slack so a frame a reader is still sending is never overwritten
+# underneath it.
+RING_SIZE = 8
+# libjpeg-turbo can only scale by eighths while decoding
+FULL_SCALE = Fraction(1)
+SCALES = (FULL_SCALE, Fraction(1, 2), Fraction(1, 4), Fraction(1, 8))
+
+
+class StreamVariant:
+    """Downscaled and/or requantized rendition of the source MJPEG stream."""
+
+    def __init__(self, scale: Fraction = FULL_SCALE, quality: Optional[int] = None):
+        if scale not in SCALES:
+            raise ValueError(f"Unsupported scale {scale}")
+        if quality is not None and not 1 <= quality <= 100:
+            raise ValueError(f"Unsupported quality {quality}")
+        self.scale = scale
+        self.quality = quality
+
+    @classmethod
+    def from_query(cls, scale: Optional[str], quality: Optional[str]) -> "StreamVariant":
+        return cls(
+            Fraction(scale) if scale else FULL_SCALE,
+            int(quality) if quality else None,
+        )
+
+    @property
+    def key(self) -> Tuple[Fraction, Optional[int]]:
+        return self.scale, self.quality
+
+    @property
+    def is_source(self) -> bool:
+        return self.scale == 1 and self.quality is None
+
+    def render(self, frame: bytes) -> bytes:
+        height, width, _, _ = simplejpeg.decode_jpeg_header(frame)
+        # Scaled decode does the downscale in the DCT domain, so only the
+        # smaller image is ever materialized
+        image = simplejpeg.decode_jpeg(
+            frame,
+            fastdct=True,
+            fastupsample=True,
+            min_height=int(height * self.scale),
+            min_width=int(width * self.scale),
+        )
+        return simplejpeg.encode_jpeg(
+            image, quality=self.quality or 75, fastdct=True
+        )
+
+    def __str__(self) -> str:
+        return f"scale={self.scale},quality={self.quality}"
+
+
+SOURCE = StreamVariant()
+
+
+def multipart_frame(frame: bytes, timestamp: float) -> bytes:
+    """One part of a multipart/x-mixed-replace; boundary=frame response.
+
+    Content-Length lets clients use a frame without waiting for the next
+    boundary. X-Timestamp is the wall clock time the frame was published,
+    for measuring viewer latency.
+    """
+    return (
+        b"--frame\r\nContent-Type: image/jpeg\r\n"
+        + f"Content-Length: {len(frame)}\r\nX-Timestamp: {timestamp:.6f}\r\n\r\n".encode()
+        + frame
+        + b"\r\n"
+    )
+
+
+class StreamReader:
+    """Per client cursor into a StreamingOutput ring."""
+
+    def __init__(self, output: "StreamingOutput", variant: StreamVariant = SOURCE):
+        self.output = output
+        self.variant = variant
+        self.seq = output.seq
+        self.delivered = 0
+        self.dropped = 0
+        # Frames published while the client was still sending the last one
+        self.lag = 0
+        # Seconds from publishing to the client picking the frame up, of the
+        # last frame and summed over all
+        self.latency = 0.0
+        self.total_latency = 0.0
+        self.connected_at = time.time()
+
+    def next_frame(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        """Blocks until a frame newer than the last one read is published.
+
+        Frames published in between are skipped and counted as dropped.
+        Returns None on timeout.
+        """
+        seq, frame = self.output.wait_newer(self.seq, timeout)
+        if frame is None:
+            return None
+        self.advance(seq)
+        return self.render(seq)
+
+    def poll(self) -> Optional[int]:
+        """Non-blocking, advances to the newest frame and returns its sequence
+        number if there is one the reader has not seen yet."""
+        seq, frame = self.output.latest()
+        if frame is None or seq <= self.seq:
+            return None
+        self.advance(seq)
+        return seq
+
+    def poll_frame(self) -> Optional[bytes]:
+        """Non-blocking variant of next_frame."""
+        seq = self.poll()
+        return None if seq is None else self.render(seq)
+
+    def render(self, seq: int) -> bytes:
+        return self.output.render(seq, self.variant)
+
+    def is_rendered(self, seq: int) -> bool:
+        return self.output.is_rendered(seq, self.variant)
+
+    def part(self, seq: int, frame: bytes) -> bytes:
+        return multipart_frame(frame, self.output.published_at(seq))
+
+    def advance(self, seq: int):
+        self.lag = max(0, seq - self.seq - 1) if self.seq else 0
+        self.dropped += self.lag
+        self.seq = seq
+        self.delivered += 1
+        self.latency = max(0.0, time.time() - self.output.published_at(seq))
+        self.total_latency += self.latency
+
+    def close(self):
+        self.output.unsubscribe(self)
+
+    @property
+    def stats(self) -> Dict:
+        return dict(
+            variant=str(self.variant),
+            delivered=self.delivered,
+            dropped=self.dropped,
+            lag=self.lag,
+            latency_ms=round(self.latency * 1000, 1),
+            mean_latency_ms=round(self.total_latency / max(1, self.delivered) * 1000, 1),
+            uptime=time.time() - self.connected_at,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class StreamingOutput(io.BufferedIOBase):
+    """Broadcast ring for encoded frames.
+
+    The camera thread publishes each frame once by reference. Readers keep
+    their own sequence number and always jump to the newest frame, so a slow
+    client never holds up the writer or the other clients.
+    """
+
+    def __init__(self, size: int = RING_SIZE):
+        self.size = size
+        self.ring: List[Optional[bytes]] = [None] * size
+        self.published: List[float] = [0.0] * size
+        # Renditions of each ring slot, tagged with the seq they were made from
+        self.variants: List[Tuple[int, Dict]] = [(0, {})] * size
+        self.variant_locks: Dict[Tuple, threading.Lock] = {}
+        self.seq = 0
+        self.condition = threading.Condition()
+        self.readers: List[StreamReader] = []
+        self.listeners: List[Callable[[int], None]] = []
+
+    @property
+    def frame(self) -> Optional[bytes]:
+        return self.latest()[1]
+
+    def writable(self):
+        return True
+
+    def write(self, buf):
+        # Only the slot assignment and the wakeup happen under the lock.
+        with self.condition:
+            slot = (self.seq + 1) % self.size
+            self.variants[slot] = (self.seq + 1, {})
+            self.ring[slot] = buf
+            self.published[slot] = time.time()
+            self.seq += 1
+            self.condition.notify_all()
+        for listener in self.listeners:
+            listener(self.seq)
+        return len(buf)
+
+    def latest(self) -> Tuple[int, Optional[bytes]]:
+        seq = self.seq
+        return seq, self.ring[seq % self.size] if seq else None
+
+    def wait_newer(self, seq: int, timeout: Optional[float] = None) -> Tuple[int, Optional[bytes]]:
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > seq, timeout):
+                return seq, None
+        return self.latest()
+
+    def published_at(self, seq: int) -> float:
+        return self.published[seq % self.size]
+
+    def is_rendered(self, seq: int, variant: StreamVariant) -> bool:
+        if variant.is_source:
+            return True
+        tag, cache = self.variants[seq % self.size]
+        return tag == seq and variant.key in cache
+
+    def render(self, seq: int, variant: StreamVariant) -> bytes:
+        """Returns frame seq as the given variant.
+
+        Each variant is encoded at most once per frame, by whichever reader
+        asks first, and only for variants someone is actually watching.
+        """
+        frame = self.ring[seq % self.size]
+        if variant.is_source:
+            return frame
+        tag, cache = self.variants[seq % self.size]
+        if tag != seq:
+            # Slot was reused while we were behind, don't cache into it
+            return variant.render(frame)
+        if variant.key in cache:
+            return cache[variant.key]
+        lock = self.variant_locks.setdefault(variant.key, threading.Lock())
+        with lock:
+            if variant.key not in cache:
+                cache[variant.key] = variant.render(frame)
+        return cache[variant.key]
+
+    def add_listener(self, listener: Callable[[int], None]):
+        """Registers a callback run on the writer thread after each frame.
+
+        Listeners must not block, they are meant for handing the wakeup over
+        to another thread or event loop.
+        """
+        self.listeners = self.listeners + [listener]
+
+    def remove_listener(self, listener: Callable[[int], None]):
+        # Equality, not identity, every access to a bound method makes a new one
+        self.listeners = [x for x in self.listeners if x != listener]
+
+    def subscribe(self, variant: StreamVariant = SOURCE) -> StreamReader:
+        reader = StreamReader(self, variant)
+        with self.condition:
+            self.readers = self.readers + [reader]
+        return reader
+
+    def unsubscribe(self, reader: StreamReader):
+        with self.condition:
+            self.readers = [r for r in self.readers if r is not reader]
+
+    @property
+    def stats(self) -> Dict:
+        readers = self.readers
+        return dict(
+            seq=self.seq,
+            clients=[reader.stats for reader in readers],
+        )